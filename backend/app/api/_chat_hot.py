@@ -0,0 +1,45 @@
+"""
+chat 热路径辅助函数
+
+sources 构建和 SSE 帧编码是纯函数且类型已知，单独抽出并加上完整类型标注，
+便于用 mypyc/Cython AOT 编译为 C 扩展（编译产物 .so 存在时会被优先加载，
+无需改动调用方代码）。
+"""
+from typing import Any, Dict, List
+
+import orjson
+
+# 预编码的 SSE 帧前后缀：直接产出 bytes，省去 Starlette 对每帧的 UTF-8 编码
+_SSE_PREFIX: bytes = b"data: "
+_SSE_SUFFIX: bytes = b"\n\n"
+
+
+def frame_sse(chunk: Dict[str, Any]) -> bytes:
+    """把一个事件块编码为完整的 SSE 帧（bytes）"""
+    return _SSE_PREFIX + orjson.dumps(chunk) + _SSE_SUFFIX
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """截断文本到 max_chars，截断时追加省略号"""
+    if len(text) > max_chars:
+        return text[:max_chars] + "..."
+    return text
+
+
+def build_sources(source_nodes: List[Any], max_chars: int) -> List[Dict[str, Any]]:
+    """从检索到的源节点构建 sources 载荷列表
+
+    Args:
+        source_nodes: NodeWithScore 列表
+        max_chars: 片段文本的最大字符数（完整文本按需获取）
+    """
+    return [
+        {
+            "text": truncate_text(node.text, max_chars),
+            "score": float(getattr(node, "score", 0.0) or 0.0),
+            "filename": node.metadata.get("filename", "未知"),
+            "file_id": node.metadata.get("file_id", ""),
+            "node_id": node.node_id
+        }
+        for node in source_nodes
+    ]
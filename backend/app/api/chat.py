@@ -1,12 +1,51 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from llama_index.core import Settings
 from ..models import ChatRequest, ChatResponse
-from ..dependencies import AgentServiceDep
+from ..dependencies import AgentServiceDep, VectorStoreServiceDep
+from ..services.semantic_cache import get_semantic_cache
+from ._chat_hot import build_sources, frame_sse
+from ..config import settings
 from ..logger import logger
-import json
+import asyncio
+import hashlib
+import logging
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# SSE content 块聚合参数：时间窗（秒）与单帧最大缓冲字符数
+FLUSH_INTERVAL = 0.015
+FLUSH_MAX_CHARS = 4096
+
+# SSE 注释帧（客户端忽略）：ack 立即打通代理缓冲，keepalive 防止空闲超时断连
+_SSE_ACK = b": ack\n\n"
+_SSE_KEEPALIVE = b": keepalive\n\n"
+KEEPALIVE_INTERVAL = 15.0
+
+# 在途请求去重（singleflight）：key -> 执行查询的独立 Task
+_INFLIGHT: dict = {}
+_INFLIGHT_LOCK = asyncio.Lock()
+
+
+def _inflight_key(user_id: str, message: str, file_ids) -> str:
+    """计算在途请求去重键"""
+    payload = "\0".join((user_id, message, ",".join(sorted(file_ids or []))))
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def _normalize_request(request: ChatRequest):
+    """请求归一化：空消息在任何 await 之前直接拒绝，避免浪费 LLM 调用和 Mem0 写入
+
+    同时去重并排序 file_ids：[a, b] 与 [b, a] 归一为同一形式，
+    下游的所有缓存键（语义缓存、singleflight、检索过滤器）因此保持稳定，
+    也让 LLM 提示前缀在重复会话间可复用（利于服务端 prompt caching）。
+    """
+    message = request.message.strip()
+    if not message:
+        raise HTTPException(status_code=400, detail="消息不能为空")
+    request.message = message
+    request.file_ids = sorted(set(request.file_ids or [])) or None
+
 @router.post("/query/stream")
 async def chat_query_stream(
     request: ChatRequest,
@@ -23,28 +62,86 @@ async def chat_query_stream(
     - 当不指定 file_ids 时，进行纯 LLM 对话
     - 结合长期记忆和文档知识提供个性化答案
     """
-    logger.info(f"收到流式聊天请求（用户: {request.user_id}）: {request.message[:50]}... (File IDs: {request.file_ids})")
+    _normalize_request(request)
+    logger.info("收到流式聊天请求（用户: %s）: %s... (File IDs: %s)", request.user_id, request.message[:50], request.file_ids)
     
     async def event_generator():
-        try:
-            # 调用流式 chat 接口
-            async for chunk in agent_service.chat_stream(
-                message=request.message,
-                file_ids=request.file_ids,
-                user_id=request.user_id
-            ):
-                # 发送 SSE 格式的数据
+        # 生产者把 agent 的流式块推入队列，消费者按时间窗聚合后发送：
+        # 小的 content 块在 15ms 窗口内合并为一帧，减少 JSON 编码和 socket 写次数
+        # （对 2000 token 的回复可减少约一个数量级的系统调用），体验上仍是流式
+        queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+        async def producer():
+            try:
+                # 调用流式 chat 接口
                 # chunk 格式: {"type": "content"|"sources"|"error"|"done", "data": ...}
-                logger.info(f"发送流式数据: {chunk}")
-                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
-        
-        except Exception as e:
-            logger.error(f"流式查询处理失败: {str(e)}", exc_info=True)
-            error_data = {
-                "type": "error",
-                "data": {"message": f"查询失败: {str(e)}"}
-            }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+                async for chunk in agent_service.chat_stream(
+                    message=request.message,
+                    file_ids=request.file_ids,
+                    user_id=request.user_id
+                ):
+                    await queue.put(chunk)
+            except Exception as e:
+                logger.error("流式查询处理失败: %s", e, exc_info=True)
+                await queue.put({
+                    "type": "error",
+                    "data": {"message": f"查询失败: {str(e)}"}
+                })
+            finally:
+                await queue.put(None)  # 结束哨兵
+
+        producer_task = asyncio.create_task(producer())
+        buf = []      # 待合并的 content 增量
+        buf_len = 0   # 已缓冲的字符数
+
+        def flush_content():
+            nonlocal buf, buf_len
+            frame = {"type": "content", "data": {"delta": "".join(buf)}}
+            buf = []
+            buf_len = 0
+            return frame_sse(frame)
+
+        try:
+            # 立即发送 ack 注释帧：验证 X-Accel-Buffering 生效、打通代理缓冲，
+            # 让客户端在 agent 产出首 token 前就能感知到流已建立
+            yield _SSE_ACK
+            last_emit = asyncio.get_running_loop().time()
+
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), timeout=FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    # 时间窗到期，冲刷已缓冲的内容
+                    if buf:
+                        yield flush_content()
+                        last_emit = asyncio.get_running_loop().time()
+                    elif asyncio.get_running_loop().time() - last_emit >= KEEPALIVE_INTERVAL:
+                        # 长时间无数据时发送 keepalive，防止代理空闲超时断开
+                        yield _SSE_KEEPALIVE
+                        last_emit = asyncio.get_running_loop().time()
+                    continue
+
+                if chunk is None:
+                    if buf:
+                        yield flush_content()
+                    break
+
+                if chunk["type"] == "content":
+                    delta = chunk["data"]["delta"]
+                    buf.append(delta)
+                    buf_len += len(delta)
+                    if buf_len >= FLUSH_MAX_CHARS:
+                        yield flush_content()
+                        last_emit = asyncio.get_running_loop().time()
+                else:
+                    # 非 content 帧（sources/done/error）先冲刷缓冲再立即发送
+                    if buf:
+                        yield flush_content()
+                    logger.debug("发送流式数据: %s", chunk)
+                    yield frame_sse(chunk)
+                    last_emit = asyncio.get_running_loop().time()
+        finally:
+            producer_task.cancel()
     
     return StreamingResponse(
         event_generator(),
@@ -56,6 +153,20 @@ async def chat_query_stream(
         }
     )
 
+@router.get("/source/{node_id}")
+async def get_source_text(
+    node_id: str,
+    vector_store_service: VectorStoreServiceDep
+):
+    """
+    获取源片段的完整文本（sources 中的 text 字段默认被截断）
+    """
+    text = await vector_store_service.get_node_text(node_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="源片段不存在")
+    return {"node_id": node_id, "text": text}
+
+
 @router.post("/query", response_model=ChatResponse)
 async def chat_query(
     request: ChatRequest,
@@ -71,8 +182,57 @@ async def chat_query(
     - 当不指定 file_ids 时，进行纯 LLM 对话
     - 结合长期记忆和文档知识提供个性化答案
     """
-    logger.info(f"收到聊天请求（用户: {request.user_id}）: {request.message[:50]}... (File IDs: {request.file_ids})")
+    _normalize_request(request)
+    logger.info("收到聊天请求（用户: %s）: %s... (File IDs: %s)", request.user_id, request.message[:50], request.file_ids)
+
+    # Singleflight：相同 (user_id, message, file_ids) 的并发请求只执行一次，
+    # 后到的请求直接等待首个请求的结果，避免惊群时重复调用 LLM。
+    # 计算放在独立 Task 中执行：首个请求的客户端断开时 uvicorn 取消的是
+    # 它的请求协程，不会连带取消计算，合并进来的请求仍能拿到结果；
+    # shield 则保护每个等待者不因自身断开而取消共享任务
+    key = _inflight_key(request.user_id, request.message, request.file_ids)
+    async with _INFLIGHT_LOCK:
+        task = _INFLIGHT.get(key)
+        if task is None:
+            task = asyncio.create_task(_execute_chat_query(request, agent_service))
+            # 完成即出表；顺带取回异常，避免所有等待者都已断开时的
+            # "exception never retrieved" 告警
+            task.add_done_callback(
+                lambda t: (_INFLIGHT.pop(key, None), t.cancelled() or t.exception())
+            )
+            _INFLIGHT[key] = task
+        else:
+            logger.info("复用在途的相同查询（用户: %s）", request.user_id)
+
+    return await asyncio.shield(task)
+
+
+async def _execute_chat_query(request: ChatRequest, agent_service) -> ORJSONResponse:
+    """执行一次完整的非流式查询（语义缓存 + agent 调用）
+
+    响应由服务端自行构造，数据形状即 ChatResponse（见 response_model），
+    直接以 ORJSONResponse 返回预构建的 dict，跳过出站 Pydantic 模型
+    构造和二次校验，orjson 在 C 层一次性完成序列化。
+    """
     try:
+        # 语义缓存：对近似重复的查询直接返回缓存结果，跳过 LLM + 检索往返
+        file_id_set = frozenset(request.file_ids or ())
+        cache_key = (request.user_id, file_id_set)
+        semantic_cache = get_semantic_cache()
+        query_embedding = None
+        try:
+            query_embedding = await Settings.embed_model.aget_query_embedding(request.message)
+            cached = semantic_cache.get(cache_key, query_embedding)
+            if cached is not None:
+                cached_response, cached_sources = cached
+                return ORJSONResponse({
+                    "response": cached_response,
+                    "sources": cached_sources
+                })
+        except Exception as cache_err:
+            # 缓存失败不影响正常查询流程
+            logger.warning("语义缓存查找失败: %s", cache_err)
+
         # 统一调用 chat 接口，根据 file_ids 自动决定是否加载文档检索工具
         # 完全使用 Mem0 管理记忆，不需要传入 chat_history
         # 返回值: (agent_output, source_nodes)
@@ -91,28 +251,28 @@ async def chat_query(
             response_text = str(agent_output)
 
         # 从返回值中获取源信息（而不是从共享实例变量）
-        sources = []
-        if source_nodes:
-            logger.info(f"获取到 {len(source_nodes)} 个源片段")
-            for node in source_nodes:
-                source_data = {
-                    "text": node.text,
-                    "score": float(node.score) if hasattr(node, 'score') else 0.0,
-                    "filename": node.metadata.get("filename", "未知"),
-                    "file_id": node.metadata.get("file_id", "")
-                }
-                sources.append(source_data)
-                logger.info(f"  - 添加片段: {source_data['filename']}, Score: {source_data['score']:.4f}")
-        else:
-            logger.info("没有可用的源片段")
-        
-        logger.info(f"最终返回 {len(sources)} 个源片段")
-        
-        return ChatResponse(
-            response=response_text,
-            sources=sources
-        )
+        # 热路径辅助函数抽在 _chat_hot 中（可 AOT 编译）
+        sources = build_sources(source_nodes or [], settings.SOURCE_TEXT_MAX_CHARS)
+
+        logger.info("最终返回 %d 个源片段", len(sources))
+        if sources and logger.isEnabledFor(logging.DEBUG):
+            for source_data in sources:
+                logger.debug("  - 片段: %s, Score: %.4f", source_data["filename"], source_data["score"])
+
+        # 写入语义缓存，供后续近似重复查询复用
+        if query_embedding is not None:
+            semantic_cache.put(
+                cache_key,
+                query_embedding,
+                (response_text, sources),
+                file_ids=file_id_set
+            )
+
+        return ORJSONResponse({
+            "response": response_text,
+            "sources": sources
+        })
     
     except Exception as e:
-        logger.error(f"查询处理失败: {str(e)}", exc_info=True)
+        logger.error("查询处理失败: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
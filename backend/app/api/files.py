@@ -1,15 +1,40 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from pydantic import TypeAdapter
 from typing import List
+from datetime import datetime
+import aiofiles
+import asyncio
+import hashlib
 import os
 import uuid
 
-from ..models import FileUploadResponse, FileInfo, DeleteFileResponse
+from ..models import (
+    FileUploadResponse,
+    FileInfo,
+    DeleteFileResponse,
+    BulkDeleteRequest,
+    BulkDeleteResponse,
+)
 from ..dependencies import VectorStoreServiceDep, DocumentProcessorDep
+from ..services.semantic_cache import get_semantic_cache
 from ..config import settings
 from ..logger import logger
 
 router = APIRouter(prefix="/files", tags=["files"])
 
+# 上传流式写入的分块大小（1 MiB）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+# 模块级缓存的校验器：整表一次校验，避免逐项 FileInfo(**file) 的 Python 开销
+_FILES_ADAPTER = TypeAdapter(List[FileInfo])
+
+
+async def _cleanup_file(file_path: str):
+    """删除残留文件，stat/unlink 放到线程池避免阻塞事件循环"""
+    if await asyncio.to_thread(os.path.exists, file_path):
+        await asyncio.to_thread(os.remove, file_path)
+
 @router.post("/upload", response_model=FileUploadResponse)
 async def upload_file(
     vector_store_service: VectorStoreServiceDep,
@@ -30,53 +55,71 @@ async def upload_file(
             detail=f"不支持的文件类型。支持的类型: {supported_exts}"
         )
     
-    # 检查文件大小
-    file.file.seek(0, 2)  # 移到文件末尾
-    file_size = file.file.tell()
-    file.file.seek(0)  # 回到文件开头
-    
-    if file_size > settings.MAX_FILE_SIZE:
-        logger.warning(f"文件大小超过限制: {file.filename}, size: {file_size}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"文件太大。最大允许 {settings.MAX_FILE_SIZE / 1024 / 1024}MB"
-        )
-    
     # 生成唯一文件 ID
     file_id = str(uuid.uuid4())
-    
+
     # 保存文件（保留原始扩展名）
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    # 上传目录已在 lifespan 中创建，无需每次请求重复 makedirs
     file_ext = os.path.splitext(file.filename)[1].lower()
     file_path = os.path.join(settings.UPLOAD_DIR, f"{file_id}{file_ext}")
-    
+
     try:
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
+        # 分块流式写入磁盘：内存占用 O(chunk)，写入不阻塞事件循环
+        # 文件大小在写入过程中累计校验，超限立即中止
+        # 同时计算 SHA-256 内容哈希（OpenSSL 硬件加速，相对 I/O 几乎免费）
+        file_size = 0
+        hasher = hashlib.sha256()
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > settings.MAX_FILE_SIZE:
+                    logger.warning(f"文件大小超过限制: {file.filename}, size: {file_size}")
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"文件太大。最大允许 {settings.MAX_FILE_SIZE / 1024 / 1024}MB"
+                    )
+                hasher.update(chunk)
+                await f.write(chunk)
+        content_hash = hasher.hexdigest()
+
+        # 内容去重：相同内容的文件已向量化过，直接复用，跳过昂贵的嵌入流程
+        existing = await vector_store_service.find_file_by_hash(content_hash)
+        if existing:
+            logger.info(f"文件内容重复，复用已有文件: {file.filename} -> {existing['file_id']}")
+            await asyncio.to_thread(os.remove, file_path)
+            # 数据由服务端自己构造，model_construct 跳过一遍字段校验
+            return FileUploadResponse.model_construct(
+                file_id=existing["file_id"],
+                filename=existing["filename"],
+                size=existing["size"],
+                uploaded_at=existing["uploaded_at"],
+                chunks_count=existing["chunks_count"]
+            )
+
         # 处理文档
         documents = await document_processor.process_file(file_path)
         
         if not documents:
             raise HTTPException(status_code=400, detail="无法从文件中提取内容")
         
-        # 添加到向量存储
-        chunks_count = await vector_store_service.add_documents(
+        # 添加到向量存储（分批并发嵌入）
+        chunks_count = await vector_store_service.add_documents_batched(
             file_id=file_id,
             filename=file.filename,
             documents=documents,
-            file_size=file_size
+            file_size=file_size,
+            content_hash=content_hash
         )
         
         logger.info(f"文件处理成功: {file.filename} (ID: {file_id}), chunks: {chunks_count}")
 
-        # 获取刚才保存的元数据（为了返回一致的时间格式）
+        # 文档库发生变化，失效语义缓存中关联该文件的条目
+        get_semantic_cache().invalidate(file_id)
+
         # 这里直接构造返回，因为 add_documents 已经是异步且我们知道保存了什么
-        import datetime
-        uploaded_at = datetime.datetime.now().isoformat()
-        
-        return FileUploadResponse(
+        uploaded_at = datetime.now()
+
+        return FileUploadResponse.model_construct(
             file_id=file_id,
             filename=file.filename,
             size=file_size,
@@ -84,23 +127,57 @@ async def upload_file(
             chunks_count=chunks_count
         )
     
+    except HTTPException:
+        # 业务校验失败（如超过大小限制），清理残留文件后原样抛出
+        await _cleanup_file(file_path)
+        raise
     except Exception as e:
         logger.error(f"处理文件上传时发生异常: {str(e)}", exc_info=True)
         # 清理文件
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await _cleanup_file(file_path)
         raise HTTPException(status_code=500, detail=f"处理文件时出错: {str(e)}")
 
 @router.get("/list", response_model=List[FileInfo])
 async def list_files(
-    vector_store_service: VectorStoreServiceDep
+    vector_store_service: VectorStoreServiceDep,
+    limit: int = Query(500, ge=1, le=500),
+    skip: int = Query(0, ge=0)
 ):
     """
-    获取所有已上传的文件
+    分页获取已上传的文件（按上传时间倒序）
     """
     logger.info("请求获取文件列表")
-    files = await vector_store_service.get_all_files()
-    return [FileInfo(**file) for file in files]
+    files = await vector_store_service.get_all_files(limit=limit, skip=skip)
+    return _FILES_ADAPTER.validate_python(files)
+
+@router.post("/bulk_delete", response_model=BulkDeleteResponse)
+async def bulk_delete_files(
+    request: BulkDeleteRequest,
+    vector_store_service: VectorStoreServiceDep
+):
+    """
+    批量删除文件及其向量
+
+    前端"全部删除"不再发 N 个串行 DELETE 请求，
+    内部所有文件共享一次 Qdrant delete 和一次 MongoDB delete_many 往返。
+    """
+    file_ids = list(dict.fromkeys(request.file_ids))
+    logger.info(f"请求批量删除 {len(file_ids)} 个文件")
+
+    try:
+        deleted = await vector_store_service.adelete_files(file_ids)
+    except Exception as e:
+        logger.error(f"批量删除失败: {e}")
+        deleted = []
+
+    failed = [fid for fid in file_ids if fid not in set(deleted)]
+    cache = get_semantic_cache()
+    for fid in deleted:
+        cache.invalidate(fid)
+
+    logger.info(f"批量删除完成: 成功 {len(deleted)}, 失败 {len(failed)}")
+    return BulkDeleteResponse.model_construct(deleted=deleted, failed=failed)
+
 
 @router.delete("/{file_id}", response_model=DeleteFileResponse)
 async def delete_file(
@@ -117,8 +194,11 @@ async def delete_file(
         logger.warning(f"删除失败，文件不存在: {file_id}")
         raise HTTPException(status_code=404, detail="文件不存在")
     
+    # 失效语义缓存中关联该文件的条目
+    get_semantic_cache().invalidate(file_id)
+
     logger.info(f"成功删除文件: {file_id}")
-    return DeleteFileResponse(
+    return DeleteFileResponse.model_construct(
         success=True,
         message=f"成功删除文件及其 {deleted_chunks} 个向量块",
         deleted_chunks=deleted_chunks
@@ -1,15 +1,23 @@
+import atexit
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 
 def setup_logger():
-    """配置并获取根 logger"""
+    """配置并获取根 logger
+
+    使用 QueueHandler + QueueListener：请求协程只做一次入队，
+    格式化和 stdout 写入在后台监听线程完成，避免高并发下
+    各 handler 争抢 stdout 锁串行化请求。
+    """
     # 获取根 logger
     logger = logging.getLogger("llamaindex_demo")
-    
+
     # 如果已经有 handler 说明已经配置过，直接返回
     if logger.handlers:
         return logger
-        
+
     logger.setLevel(logging.INFO)
 
     # 创建控制台处理器
@@ -22,12 +30,18 @@ def setup_logger():
     )
     console_handler.setFormatter(formatter)
 
-    # 添加处理器到 logger
-    logger.addHandler(console_handler)
-    
+    # 请求路径上只入队，后台线程负责格式化和输出
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
+
     # 防止日志传播到父 logger (如果有的话)
     logger.propagate = False
-    
+
     return logger
 
 # 初始化全局 logger
@@ -1,28 +1,135 @@
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi import Request
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
+import logging
+import os
 import time
 import warnings
 
+# 使用 uvloop 事件循环（libuv，C 实现），I/O 密集的异步负载典型提升 2-4 倍
+# Windows 等不支持的平台回退到默认 asyncio 循环
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # 过滤第三方库的 Pydantic 弃用警告
 # 这些警告来自 mem0ai 和 llama-index 内部使用的已弃用 Pydantic V1 API
 # 项目本身的代码已升级到 Pydantic V2 标准
+# 按 category + 来源模块过滤：每条警告只需匹配一次短模块名，
+# 不再对长弃用消息逐条跑管道正则
 warnings.filterwarnings(
     "ignore",
     category=DeprecationWarning,
-    message=".*__fields__.*|.*__fields_set__.*|.*model_computed_fields.*|.*model_fields.*|.*OPENAI_API_BASE.*"
+    module=r"(mem0|llama_index|pydantic)(\.|$)"
 )
 
 from .config import settings
-from .services.vector_store import get_vector_store_service
+from .services.vector_store import configure_llm_settings, get_vector_store_service
+from .services.agent_service import get_agent_service
 from .api import files, chat
 from .logger import logger
 
+
+class FastPathMiddleware:
+    """融合 CORS 与请求计时的纯 ASGI 中间件
+
+    相比 BaseHTTPMiddleware（@app.middleware("http")）+ CORSMiddleware 的
+    两层包装，不为每个请求构造 Request/StreamingResponse 对象、不额外起
+    协程任务，且两个职责共用同一个 send_wrapper，每请求只多一层 await，
+    对 SSE 流式响应也不会引入缓冲。
+
+    CORS 策略与原 CORSMiddleware 配置等价（放开任意来源且允许携带凭据，
+    生产环境应限制域名）：带凭据时浏览器拒绝 "*"，因此与 Starlette 一样
+    回显请求的 Origin 并带上 Vary: Origin；固定部分在导入期预编码为
+    bytes 元组，请求路径上零编码开销。
+    """
+
+    # 预编码的 CORS 固定头（bytes 对），allow-origin 按请求回显
+    _CORS_BASE = [
+        (b"access-control-allow-credentials", b"true"),
+        (b"vary", b"Origin"),
+    ]
+    # 带凭据时 allow-methods/allow-headers 的 "*" 会被浏览器当作字面量，
+    # 与 Starlette 对 allow_methods=["*"] 的处理一致：方法展开为显式列表，
+    # 请求头按预检请求的 access-control-request-headers 回显
+    _PREFLIGHT_BASE = _CORS_BASE + [
+        (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+        (b"access-control-max-age", b"600"),
+    ]
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        # 内联处理 CORS 预检请求，不进入路由层
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = list(self._PREFLIGHT_BASE)
+            if origin is not None:
+                headers.append((b"access-control-allow-origin", origin))
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({
+                "type": "http.response.start",
+                "status": 204,
+                "headers": headers,
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        start_time = time.perf_counter()
+        method = scope["method"]
+        path = scope["path"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if origin is not None:
+                    message["headers"] = (
+                        list(message["headers"])
+                        + [(b"access-control-allow-origin", origin)]
+                        + self._CORS_BASE
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+            # 级别门控 + %-延迟格式化：生产环境只记 WARNING 时，
+            # 热路径上连参数元组的格式化开销都不产生；错误路径罕见，保持原样
+            if logger.isEnabledFor(logging.INFO):
+                process_time = time.perf_counter() - start_time
+                logger.info("Method: %s | Path: %s | Status: %s | Duration: %.4fs", method, path, status_code, process_time)
+        except Exception as e:
+            process_time = time.perf_counter() - start_time
+            logger.error("Method: %s | Path: %s | Status: 500 | Duration: %.4fs | Error: %s", method, path, process_time, e)
+            raise
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动时初始化向量存储
+    # 启动时创建上传目录（请求路径上不再重复 makedirs）
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    # 显式配置全局 LlamaIndex Settings（嵌入模型 / LLM）
+    configure_llm_settings()
+    # 初始化向量存储
     vector_store_service = get_vector_store_service()
     await vector_store_service.initialize()
     logger.info("✅ 向量存储服务已初始化")
@@ -33,45 +140,33 @@ async def lifespan(app: FastAPI):
 app = FastAPI(
     title=settings.API_TITLE,
     version=settings.API_VERSION,
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson 在 C 层序列化（SIMD UTF-8），比默认 json 编码快数倍
+    default_response_class=ORJSONResponse
 )
 
-@app.middleware("http")
-async def log_request_time(request: Request, call_next):
-    """记录请求耗时的中间件"""
-    start_time = time.perf_counter()
-    try:
-        response = await call_next(request)
-        process_time = time.perf_counter() - start_time
-        logger.info(f"Method: {request.method} | Path: {request.url.path} | Status: {response.status_code} | Duration: {process_time:.4f}s")
-        return response
-    except Exception as e:
-        process_time = time.perf_counter() - start_time
-        logger.error(f"Method: {request.method} | Path: {request.url.path} | Status: 500 | Duration: {process_time:.4f}s | Error: {str(e)}")
-        raise e
-
-# 配置 CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 生产环境应该限制具体域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS + 请求计时（单个纯 ASGI 中间件，注册在最外层）
+app.add_middleware(FastPathMiddleware)
 
 # 注册路由
 app.include_router(files.router, prefix="/api")
 app.include_router(chat.router, prefix="/api")
 
+# 根路径响应内容固定，导入期构造一次，请求路径上不再重复建 dict
+_ROOT_PAYLOAD = {
+    "message": "LlamaIndex RAG API",
+    "version": settings.API_VERSION,
+    "docs": "/docs"
+}
+
 # API 根路径
 @app.get("/")
 async def root():
-    return {
-        "message": "LlamaIndex RAG API",
-        "version": settings.API_VERSION,
-        "docs": "/docs"
-    }
+    return _ROOT_PAYLOAD
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "mem0_cache": get_agent_service().mem0_cache_stats()
+    }
@@ -10,18 +10,18 @@ class FileUploadResponse(BaseModel):
     file_id: str = Field(..., description="文件唯一标识符")
     filename: str = Field(..., description="文件名")
     size: int = Field(..., ge=0, description="文件大小（字节）")
-    uploaded_at: str = Field(..., description="上传时间")
+    uploaded_at: datetime = Field(..., description="上传时间")
     chunks_count: int = Field(..., ge=0, description="文档分块数量")
 
 
 class FileInfo(BaseModel):
     """文件信息模型"""
     model_config = ConfigDict(from_attributes=True)
-    
+
     file_id: str = Field(..., description="文件唯一标识符")
     filename: str = Field(..., description="文件名")
     size: int = Field(..., ge=0, description="文件大小（字节）")
-    uploaded_at: str = Field(..., description="上传时间")
+    uploaded_at: datetime = Field(..., description="上传时间")
     chunks_count: int = Field(..., ge=0, description="文档分块数量")
 
 
@@ -34,6 +34,21 @@ class DeleteFileResponse(BaseModel):
     deleted_chunks: int = Field(..., ge=0, description="删除的文档块数量")
 
 
+class BulkDeleteRequest(BaseModel):
+    """批量删除文件请求模型"""
+    model_config = ConfigDict(from_attributes=True)
+
+    file_ids: List[str] = Field(..., description="要删除的文件ID列表")
+
+
+class BulkDeleteResponse(BaseModel):
+    """批量删除文件响应模型"""
+    model_config = ConfigDict(from_attributes=True)
+
+    deleted: List[str] = Field(default_factory=list, description="删除成功的文件ID列表")
+    failed: List[str] = Field(default_factory=list, description="删除失败或不存在的文件ID列表")
+
+
 class ChatRequest(BaseModel):
     """聊天请求模型"""
     model_config = ConfigDict(from_attributes=True)
@@ -43,9 +58,20 @@ class ChatRequest(BaseModel):
     user_id: str = Field(default="default_user", description="用户ID，用于 Mem0 记忆管理")
 
 
+class SourceInfo(BaseModel):
+    """引用的源文档片段模型"""
+    model_config = ConfigDict(from_attributes=True)
+
+    text: str = Field(..., description="片段文本（可能被截断，完整文本按需获取）")
+    score: float = Field(default=0.0, description="相似度分数")
+    filename: str = Field(default="未知", description="来源文件名")
+    file_id: str = Field(default="", description="来源文件ID")
+    node_id: str = Field(default="", description="节点ID，用于获取完整片段文本")
+
+
 class ChatResponse(BaseModel):
     """聊天响应模型"""
     model_config = ConfigDict(from_attributes=True)
-    
+
     response: str = Field(..., description="助手回复")
-    sources: List[dict] = Field(default_factory=list, description="引用的源文档列表")
+    sources: List[SourceInfo] = Field(default_factory=list, description="引用的源文档列表")
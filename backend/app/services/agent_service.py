@@ -1,24 +1,170 @@
 from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
 from llama_index.core.vector_stores import MetadataFilters, MetadataFilter, FilterOperator, FilterCondition
 from llama_index.core.tools import FunctionTool
 from llama_index.core.agent.workflow import FunctionAgent, AgentStream
-from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.memory.mem0 import Mem0Memory
-from typing import List, Dict, Optional, AsyncGenerator
+from qdrant_client import QdrantClient
+from typing import List, Dict, Final, Optional, AsyncGenerator
+from collections import OrderedDict
 import asyncio
+import contextvars
+import hashlib
+import logging
+import time
 
+from ..api._chat_hot import build_sources
 from ..logger import logger
 from .vector_store import VectorStoreService
+from .semantic_cache import SemanticCache
 from ..config import settings
 
 
+# Mem0 OSS 配置模板：仅 vector_store 的 collection_name 随用户变化，
+# 其余部分在导入期固定，创建记忆实例时浅拷贝并填入用户集合名
+_MEM0_CONFIG_TEMPLATE: Final[Dict] = {
+    "vector_store": {
+        "provider": "qdrant",
+        "config": {
+            "host": settings.QDRANT_HOST,
+            "port": settings.QDRANT_PORT,
+            "embedding_model_dims": 1536,
+        },
+    },
+    "llm": {
+        "provider": "openai",
+        "config": {
+            "model": settings.OPENAI_MODEL,
+            "temperature": 0.2,
+            "max_tokens": 1500,
+            # 不要在这里设置 api_key 和 base_url
+            # Mem0 会自动从环境变量读取
+        },
+    },
+    "embedder": {
+        "provider": "openai",
+        "config": {
+            "model": settings.OPENAI_EMBEDDING_MODEL,
+            # 不要在这里设置 api_key 和 base_url
+            # Mem0 会自动从环境变量读取
+        },
+    },
+    "version": "v1.1",
+}
+
+# System Prompt 与工具描述为模块级常量：每次构建 agent 复用同一字符串对象，
+# 不在请求路径上重新绑定多 KB 的字面量
+
+# 无检索工具时的默认 System Prompt
+SYSTEM_PROMPT_CHAT_ONLY: Final[str] = "你是一个友好的智能助手。你能记住用户的偏好和过往对话信息，提供个性化的服务。"
+
+# 携带文档检索工具时的 System Prompt
+SYSTEM_PROMPT_WITH_TOOLS: Final[str] = """你是一个智能助手，拥有长期记忆和文档检索能力。
+
+## 你的能力
+
+1. **长期记忆** - 自动记住用户的偏好、背景信息
+2. **文档检索** - 使用 search_documents 工具查询用户上传的文档
+3. **知识问答** - 在没有相关文档时提供通用知识
+
+## 核心工具使用策略：优先使用工具
+
+### ⚠️ 重要原则
+**默认行为：对任何问题都应该优先尝试使用 search_documents 工具进行检索**
+
+这意味着：
+- 收到用户问题后，首先思考"能否通过检索找到答案"
+- 即使问题看起来像常识，也应该先检索（因为文档中可能有更专业、更准确的答案）
+- 即使你认为你知道答案，也应该先检索（因为文档中可能有更新、更具体的信息）
+
+### ✅ 必须使用 search_documents 工具：
+- 任何专业领域问题（技术、业务、学术、行业知识等）
+- 任何可能需要引用数据、观点、细节的问题
+- 任何通用知识问题（因为文档中可能有更专业的解释）
+- 用户的大部分提问和询问
+- **当不确定是否需要工具时 → 使用工具！**
+
+### ❌ 极少数不使用工具的情况：
+- **仅限**简单问候（如"你好"、"早上好"、"再见"）
+- **仅限**明确的简单数学计算（如"1+1"、"10*5"）
+- **仅限**关于你自己的介绍性问题（如"你是谁"、"你能做什么"）
+- **仅限**编程相关问题（如"Python怎样进行异步编程"）
+
+### 🎯 决策流程：
+1. 收到用户问题
+2. 这是简单问候或介绍性问题吗？→ 否 → **立即使用 search_documents 工具**
+3. 这是明确的简单计算吗？→ 否 → **立即使用 search_documents 工具**
+4. 任何其他情况 → **立即使用 search_documents 工具**
+
+## 回答要求
+- 优先使用工具检索，基于检索结果回答
+- 如果检索结果不相关，再考虑使用通用知识补充
+- 结合长期记忆，提供个性化的回答
+- 宁可多检索，不要凭记忆编造"""
+
+# search_documents 工具描述
+SEARCH_TOOL_DESC: Final[str] = """检索知识库中的文档内容。这是你最重要的工具，应该优先使用。
+
+**优先使用此工具的情况（覆盖绝大部分场景）：**
+- 任何可能与文档相关的问题
+- 专业领域的问题（技术、业务、学术等）
+- 需要具体数据、观点、细节的问题
+- 用户的任何提问（除非明确是问候语或简单计算）
+- 当你不确定时，宁可使用工具也不要凭记忆回答
+
+**极少数不使用此工具的情况：**
+- 仅限简单问候语（如"你好"、"早上好"）
+- 明确的数学计算（如"1+1等于多少"）
+
+**核心原则：宁可多查，不可少查。当有任何疑问时，必须使用工具检索。**
+"""
+
+# 每请求状态经 ContextVar 传递：缓存的 agent/工具闭包不持有请求数据，
+# agent.run 派生的任务会继承设置时的上下文
+_source_nodes_var: contextvars.ContextVar[Optional[List]] = contextvars.ContextVar(
+    "source_nodes_container", default=None
+)
+_prefetch_var: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar(
+    "prefetch", default=None
+)
+
+
 class AgentService:
     """智能代理服务 - 负责处理对话和查询"""
-    
+
+    # 非流式响应的精确匹配缓存参数（LRU 上限 / TTL 秒）
+    _RESP_CACHE_MAX = 128
+    _RESP_CACHE_TTL = 600.0
+
+    # agent + query_engine 缓存的最大文件组合数
+    _AGENT_CACHE_MAX = 32
+
     def __init__(self, vector_store_service: VectorStoreService):
         self.vector_store_service = vector_store_service
-        self._mem0_memories = {}  # 缓存不同用户的记忆实例
-        self._mem0_lock = asyncio.Lock()  # 保护 _mem0_memories 的锁
+        # 缓存不同用户的记忆实例（LRU 淘汰，上限 MEM0_CACHE_MAX，防止随用户数无界增长）
+        self._mem0_memories: OrderedDict = OrderedDict()
+        self._mem0_hits = 0
+        self._mem0_misses = 0
+        # 每用户一把创建锁：不同用户的 Mem0 初始化（Qdrant + OpenAI I/O）可并行，
+        # _locks_guard 只保护锁字典本身的插入，持有时间极短
+        self._mem0_locks: Dict[str, asyncio.Lock] = {}
+        self._locks_guard = asyncio.Lock()
+        # 精确匹配的响应缓存：相同 (user_id, message, file_ids) 在 TTL 内
+        # 直接复用结果，省掉整个 agent 规划 + 检索 + LLM 往返。
+        # 缓存键包含 files_version，文档增删后旧条目自动失效
+        self._resp_cache: OrderedDict = OrderedDict()
+        # 检索级语义缓存：近似重复的工具查询直接复用检索结果
+        # （流式与非流式路径共享）；键含 files_version，文档增删后自动失效
+        self._retrieval_cache = SemanticCache(
+            threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+            ttl=settings.SEMANTIC_CACHE_TTL,
+            maxsize=settings.SEMANTIC_CACHE_MAXSIZE,
+        )
+        # (frozenset(file_ids), top_k, files_version) -> (FunctionAgent, query_engine, retriever)
+        self._agent_cache: OrderedDict = OrderedDict()
+        # Mem0 OSS 专用的共享同步 Qdrant 客户端：首次 OSS 初始化时才创建，
+        # Platform 模式或未启用记忆的部署不会多开一条同步连接
+        self._mem0_qdrant_client: Optional[QdrantClient] = None
     
     async def _get_or_create_memory(self, user_id: str) -> Mem0Memory:
         """
@@ -31,10 +177,18 @@ class AgentService:
         """
         # 先检查是否已存在（无锁快速路径）
         if user_id in self._mem0_memories:
+            self._mem0_memories.move_to_end(user_id)
+            self._mem0_hits += 1
             return self._mem0_memories.get(user_id)
-        
-        # 需要创建，使用锁保护
-        async with self._mem0_lock:
+        self._mem0_misses += 1
+
+        # 需要创建，使用该用户的锁保护（不同用户互不阻塞）
+        lock = self._mem0_locks.get(user_id)
+        if lock is None:
+            async with self._locks_guard:
+                lock = self._mem0_locks.setdefault(user_id, asyncio.Lock())
+
+        async with lock:
             # 双重检查，避免重复创建
             if user_id not in self._mem0_memories:
                 try:
@@ -43,58 +197,45 @@ class AgentService:
                     # 如果配置了 Mem0 Platform API Key，使用 Platform 模式
                     if settings.MEM0_API_KEY:
                         logger.info(f"为用户 {user_id} 创建 Mem0 Platform 记忆实例")
-                        self._mem0_memories[user_id] = Mem0Memory.from_client(
+                        # from_client 内部有同步网络握手，放到线程池执行，
+                        # 避免阻塞事件循环拖慢其他在途请求
+                        self._mem0_memories[user_id] = await asyncio.to_thread(
+                            Mem0Memory.from_client,
                             context=context,
                             api_key=settings.MEM0_API_KEY,
                             search_msg_limit=settings.MEM0_SEARCH_MSG_LIMIT,
                         )
                         logger.info(f"✅ 成功为用户 {user_id} 创建 Mem0 Platform 记忆实例")
                     else:
-                        # OSS 模式：通过环境变量配置
+                        # OSS 模式：OpenAI 环境变量（含 OPENAI_BASE_URL）已在
+                        # config 导入时设置一次，Mem0 会自动读取，
+                        # 请求路径上不再重复写 os.environ
                         logger.info(f"尝试为用户 {user_id} 创建 Mem0 OSS 记忆实例")
-                        logger.warning("⚠️  Mem0 需要通过环境变量访问 OpenAI API")
-                        logger.warning("⚠️  如果你使用 Azure OpenAI 或其他自定义 endpoint，建议使用 Mem0 Platform")
-                        
-                        # 设置环境变量（Mem0 会自动读取）
-                        import os
-                        os.environ["OPENAI_API_KEY"] = settings.OPENAI_API_KEY
-                        if settings.OPENAI_API_BASE:
-                            # Mem0 推荐使用 OPENAI_BASE_URL (新版本)，也支持 OPENAI_API_BASE (旧版本)
-                            os.environ["OPENAI_BASE_URL"] = settings.OPENAI_API_BASE
-                            os.environ["OPENAI_API_BASE"] = settings.OPENAI_API_BASE  # 兼容旧版本
-                            logger.info(f"   设置 OPENAI_BASE_URL: {settings.OPENAI_API_BASE}")
-                        
+
+                        # 从模板拷贝配置，仅填入随用户变化的集合名。
+                        # 同时把懒创建的共享同步客户端传给 Mem0：
+                        # 所有用户的记忆共享同一连接池（集合不同、传输层复用），
+                        # 每次 search/add 不再支付新建连接与 TCP 握手
+                        if self._mem0_qdrant_client is None:
+                            self._mem0_qdrant_client = QdrantClient(
+                                host=settings.QDRANT_HOST,
+                                port=settings.QDRANT_PORT,
+                            )
                         mem0_config = {
+                            **_MEM0_CONFIG_TEMPLATE,
                             "vector_store": {
                                 "provider": "qdrant",
                                 "config": {
+                                    **_MEM0_CONFIG_TEMPLATE["vector_store"]["config"],
                                     "collection_name": f"mem0_{user_id}",
-                                    "host": settings.QDRANT_HOST,
-                                    "port": settings.QDRANT_PORT,
-                                    "embedding_model_dims": 1536,
-                                },
-                            },
-                            "llm": {
-                                "provider": "openai",
-                                "config": {
-                                    "model": settings.OPENAI_MODEL,
-                                    "temperature": 0.2,
-                                    "max_tokens": 1500,
-                                    # 不要在这里设置 api_key 和 base_url
-                                    # Mem0 会自动从环境变量读取
-                                },
-                            },
-                            "embedder": {
-                                "provider": "openai",
-                                "config": {
-                                    "model": settings.OPENAI_EMBEDDING_MODEL,
-                                    # 不要在这里设置 api_key 和 base_url
-                                    # Mem0 会自动从环境变量读取
+                                    "client": self._mem0_qdrant_client,
                                 },
                             },
-                            "version": "v1.1",
                         }
-                        self._mem0_memories[user_id] = Mem0Memory.from_config(
+                        # from_config 会同步创建 Qdrant 集合并与 OpenAI 握手，
+                        # 放到线程池执行；每用户锁保证同一用户只有一次阻塞初始化
+                        self._mem0_memories[user_id] = await asyncio.to_thread(
+                            Mem0Memory.from_config,
                             context=context,
                             config=mem0_config,
                             search_msg_limit=settings.MEM0_SEARCH_MSG_LIMIT,
@@ -109,44 +250,116 @@ class AgentService:
                     # 如果失败，缓存 None，避免重复尝试
                     self._mem0_memories[user_id] = None
                     return None
-            
+
+            # 标记为最近使用并按 LRU 淘汰最久未用的实例，连同其创建锁一起清理
+            self._mem0_memories.move_to_end(user_id)
+            if len(self._mem0_memories) > settings.MEM0_CACHE_MAX:
+                evicted_id, evicted = self._mem0_memories.popitem(last=False)
+                self._mem0_locks.pop(evicted_id, None)
+                logger.info(f"Mem0 记忆缓存已满，淘汰最久未用的用户: {evicted_id}")
+                closer = getattr(evicted, "aclose", None)
+                if closer is not None:
+                    try:
+                        await closer()
+                    except Exception as e:
+                        logger.warning(f"关闭被淘汰的 Mem0 实例失败: {e}")
+
             return self._mem0_memories.get(user_id)
     
+    def mem0_cache_stats(self) -> Dict:
+        """Mem0 记忆缓存的大小与命中统计（供 /health 观测）"""
+        return {
+            "size": len(self._mem0_memories),
+            "hits": self._mem0_hits,
+            "misses": self._mem0_misses,
+        }
+
     async def _create_agent(
-        self, 
-        file_ids: Optional[List[str]], 
-        top_k: int, 
-        user_id: str
+        self,
+        file_ids: Optional[List[str]],
+        top_k: int,
+        user_id: str,
+        prefetch_query: Optional[str] = None
     ) -> tuple[FunctionAgent, Optional[Mem0Memory], List]:
         """
         创建一个配置好的 Agent 实例，包含工具和记忆
-        
+
         Args:
             file_ids: 文件ID列表
             top_k: 检索数量
             user_id: 用户ID
-            
+            prefetch_query: 预取查询。非空时立即并行启动一次向量检索
+                （仅检索，不做 LLM 合成），与 LLM 的首次规划重叠；
+                工具被调用且查询一致时复用检索结果、按需合成
+
         Returns:
             tuple: (agent, memory, source_nodes_container)
         """
-        # 初始化向量存储（如果需要）
-        if file_ids and not self.vector_store_service.index:
-            await self.vector_store_service.initialize()
-        
+        # 向量存储已在 lifespan 中初始化（initialize 本身幂等），
+        # 请求路径上不再做防御性重入检查
+
         # 获取或创建该用户的 Mem0 记忆实例
         memory = await self._get_or_create_memory(user_id)
-        
+
+        # agent + query_engine 按 (文件集合, top_k, 文档库版本) 缓存复用：
+        # MetadataFilters/FunctionTool/FunctionAgent 的 Pydantic 构造只在
+        # 首次出现该参数组合时发生；文档增删后版本号变化，旧条目自动失效。
+        # top_k 纳入键中，不同检索数量不会复用按旧值构建的 query_engine。
+        # Mem0 记忆仍按调用传入（agent.run(memory=...)），用户隔离不变
+        cache_key = (
+            frozenset(file_ids or ()),
+            top_k,
+            self.vector_store_service.files_version,
+        )
+        cached = self._agent_cache.get(cache_key)
+        if cached is not None:
+            self._agent_cache.move_to_end(cache_key)
+            agent, query_engine, retriever = cached
+        else:
+            agent, query_engine, retriever = self._build_agent(file_ids, top_k)
+            self._agent_cache[cache_key] = (agent, query_engine, retriever)
+            while len(self._agent_cache) > self._AGENT_CACHE_MAX:
+                self._agent_cache.popitem(last=False)
+
+        # 每请求状态写入 ContextVar（缓存的工具闭包从中读取）
+        source_nodes_container: List = []
+        _source_nodes_var.set(source_nodes_container)
+
+        prefetch = None
+        if retriever is not None and prefetch_query:
+            # 预取：向量检索与 LLM 首次规划（prompt prefill）并行，缩短首
+            # token 时间。只预取检索阶段——agent 经常改写查询、问候语甚至
+            # 不调工具，预取若带 LLM 合成，未命中时就白付一次计费调用；
+            # 纯检索的成本只是一次嵌入查找 + Qdrant 往返
+            prefetch_task = asyncio.create_task(retriever.aretrieve(prefetch_query))
+            # 工具未被调用时丢弃结果并消费异常，避免未取回异常的告警
+            prefetch_task.add_done_callback(
+                lambda t: t.cancelled() or t.exception()
+            )
+            prefetch = (prefetch_query, prefetch_task)
+        _prefetch_var.set(prefetch)
+
+        return agent, memory, source_nodes_container
+
+    def _build_agent(self, file_ids: Optional[List[str]], top_k: int):
+        """构建 agent、query_engine 与 retriever（仅在 agent 缓存未命中时调用）
+
+        Returns:
+            tuple: (agent, query_engine, retriever)，
+            无 file_ids 时后两者为 None
+        """
         # 根据 file_ids 决定是否添加文档检索工具
         tools = []
-        source_nodes_container = []  # 用于收集源节点
-        
+        query_engine = None
+        retriever = None
+
         # 默认 System Prompt
-        system_prompt = "你是一个友好的智能助手。你能记住用户的偏好和过往对话信息，提供个性化的服务。"
-        
+        system_prompt = SYSTEM_PROMPT_CHAT_ONLY
+
         if file_ids:
             # 有文件ID，创建文档检索工具
             logger.info(f"加载文档检索工具，文件ID: {file_ids}")
-            
+
             filters = MetadataFilters(
                 filters=[
                     MetadataFilter(key="file_id", value=fid)
@@ -154,92 +367,96 @@ class AgentService:
                 ],
                 condition=FilterCondition.OR,
             )
-            
+
             query_engine = self.vector_store_service.index.as_query_engine(
                 similarity_top_k=top_k,
                 filters=filters
             )
-            
+            # 与 query_engine 同参的纯检索器，供预取路径使用（不触发 LLM 合成）
+            retriever = self.vector_store_service.index.as_retriever(
+                similarity_top_k=top_k,
+                filters=filters
+            )
+
+            retrieval_key = (frozenset(file_ids), self.vector_store_service.files_version)
+
             async def search_documents(query: str):
                 """Useful for answering natural language questions about uploaded documents."""
                 logger.info(f"Agent调用搜索工具，查询内容: {query}")
-                response = await query_engine.aquery(query)
-                logger.info(f"搜索工具返回结果: {str(response)[:200]}... (Total len: {len(str(response))})")
-                
+                source_nodes_container = _source_nodes_var.get() or []
+                prefetch = _prefetch_var.get()
+
+                # 检索级语义缓存：近似重复的查询（余弦相似度过阈值）直接复用
+                # 缓存的检索结果，一次点积替代 Qdrant 往返 + LLM 响应合成
+                query_embedding = None
+                try:
+                    query_embedding = await Settings.embed_model.aget_query_embedding(query)
+                    cached = self._retrieval_cache.get(retrieval_key, query_embedding)
+                    if cached is not None:
+                        cached_text, cached_nodes = cached
+                        source_nodes_container.extend(cached_nodes)
+                        if prefetch is not None and not prefetch[1].done():
+                            prefetch[1].cancel()
+                        return cached_text
+                except Exception as e:
+                    logger.warning(f"检索语义缓存查找失败: {e}")
+
+                response = None
+                if prefetch is not None:
+                    prefetch_query, prefetch_task = prefetch
+                    if query == prefetch_query and not prefetch_task.cancelled():
+                        try:
+                            # 预取只做了检索，LLM 合成在此按需执行
+                            prefetched_nodes = await prefetch_task
+                            response = await query_engine.asynthesize(
+                                QueryBundle(query_str=query),
+                                nodes=prefetched_nodes,
+                            )
+                            logger.info("复用预取的检索结果")
+                        except Exception as e:
+                            logger.warning(f"预取检索失败，回退到实时检索: {e}")
+                            response = None
+                    elif not prefetch_task.done():
+                        prefetch_task.cancel()
+                if response is None:
+                    response = await query_engine.aquery(query)
+                response_text = str(response)
+                logger.info("搜索工具返回结果: %s... (Total len: %d)", response_text[:200], len(response_text))
+
                 # 保存源节点到容器中
                 if hasattr(response, 'source_nodes'):
                     # 将本次检索结果添加到容器中（支持多次检索累加）
                     source_nodes_container.extend(response.source_nodes)
-                    logger.info(f"搜索到 {len(response.source_nodes)} 个相关片段")
-                    for i, node in enumerate(response.source_nodes):
-                        logger.info(f"  [片段 {i+1}] Score: {node.score:.4f}, File: {node.metadata.get('filename')}")
-                        logger.info(f"  Content: {node.text[:100]}...")
-                
-                return str(response)
+                    logger.info("搜索到 %d 个相关片段", len(response.source_nodes))
+                    # 逐片段内容（含 KB 级文本切片）只在 DEBUG 级别输出，
+                    # INFO 及以上时热路径不做任何字符串格式化
+                    if logger.isEnabledFor(logging.DEBUG):
+                        for i, node in enumerate(response.source_nodes):
+                            logger.debug(
+                                "  [片段 %d] Score: %.4f, File: %s, Content: %s...",
+                                i + 1, node.score,
+                                node.metadata.get('filename'), node.text[:100]
+                            )
+
+                    # 写入语义缓存，供后续近似重复的查询复用
+                    if query_embedding is not None:
+                        self._retrieval_cache.put(
+                            retrieval_key,
+                            query_embedding,
+                            (response_text, list(response.source_nodes)),
+                            file_ids=frozenset(file_ids)
+                        )
+
+                return response_text
             
             query_tool = FunctionTool.from_defaults(
                 async_fn=search_documents,
                 name="search_documents",
-                description="""检索知识库中的文档内容。这是你最重要的工具，应该优先使用。
-
-**优先使用此工具的情况（覆盖绝大部分场景）：**
-- 任何可能与文档相关的问题
-- 专业领域的问题（技术、业务、学术等）
-- 需要具体数据、观点、细节的问题
-- 用户的任何提问（除非明确是问候语或简单计算）
-- 当你不确定时，宁可使用工具也不要凭记忆回答
-
-**极少数不使用此工具的情况：**
-- 仅限简单问候语（如"你好"、"早上好"）
-- 明确的数学计算（如"1+1等于多少"）
-
-**核心原则：宁可多查，不可少查。当有任何疑问时，必须使用工具检索。**
-"""
+                description=SEARCH_TOOL_DESC
             )
-            
-            tools = [query_tool]
-            system_prompt = """你是一个智能助手，拥有长期记忆和文档检索能力。
-
-## 你的能力
-
-1. **长期记忆** - 自动记住用户的偏好、背景信息
-2. **文档检索** - 使用 search_documents 工具查询用户上传的文档
-3. **知识问答** - 在没有相关文档时提供通用知识
 
-## 核心工具使用策略：优先使用工具
-
-### ⚠️ 重要原则
-**默认行为：对任何问题都应该优先尝试使用 search_documents 工具进行检索**
-
-这意味着：
-- 收到用户问题后，首先思考"能否通过检索找到答案"
-- 即使问题看起来像常识，也应该先检索（因为文档中可能有更专业、更准确的答案）
-- 即使你认为你知道答案，也应该先检索（因为文档中可能有更新、更具体的信息）
-
-### ✅ 必须使用 search_documents 工具：
-- 任何专业领域问题（技术、业务、学术、行业知识等）
-- 任何可能需要引用数据、观点、细节的问题
-- 任何通用知识问题（因为文档中可能有更专业的解释）
-- 用户的大部分提问和询问
-- **当不确定是否需要工具时 → 使用工具！**
-
-### ❌ 极少数不使用工具的情况：
-- **仅限**简单问候（如"你好"、"早上好"、"再见"）
-- **仅限**明确的简单数学计算（如"1+1"、"10*5"）
-- **仅限**关于你自己的介绍性问题（如"你是谁"、"你能做什么"）
-- **仅限**编程相关问题（如"Python怎样进行异步编程"）
-
-### 🎯 决策流程：
-1. 收到用户问题
-2. 这是简单问候或介绍性问题吗？→ 否 → **立即使用 search_documents 工具**
-3. 这是明确的简单计算吗？→ 否 → **立即使用 search_documents 工具**
-4. 任何其他情况 → **立即使用 search_documents 工具**
-
-## 回答要求
-- 优先使用工具检索，基于检索结果回答
-- 如果检索结果不相关，再考虑使用通用知识补充
-- 结合长期记忆，提供个性化的回答
-- 宁可多检索，不要凭记忆编造"""
+            tools = [query_tool]
+            system_prompt = SYSTEM_PROMPT_WITH_TOOLS
         else:
             # 没有文件ID，不加载文档检索工具
             logger.info("未指定文件ID，不加载文档检索工具")
@@ -251,8 +468,8 @@ class AgentService:
             llm=Settings.llm,
             system_prompt=system_prompt
         )
-        
-        return agent, memory, source_nodes_container
+
+        return agent, query_engine, retriever
 
     async def chat(self, message: str, file_ids: Optional[List[str]] = None, top_k: int = 3, user_id: str = "default_user"):
         """
@@ -269,6 +486,22 @@ class AgentService:
         Returns:
             tuple: (agent_output, source_nodes) - agent输出和源节点列表
         """
+        # 精确匹配缓存：键含文档库版本号，上传/删除文件后自动失效
+        digest = hashlib.blake2b(
+            "\0".join((user_id, message, ",".join(sorted(file_ids or [])))).encode(),
+            digest_size=16
+        ).digest()
+        cache_key = (digest, self.vector_store_service.files_version)
+        now = time.monotonic()
+        cached = self._resp_cache.get(cache_key)
+        if cached is not None:
+            output, source_nodes, expires_at = cached
+            if now < expires_at:
+                self._resp_cache.move_to_end(cache_key)
+                logger.info(f"响应缓存命中，跳过 agent 调用（用户: {user_id}）")
+                return output, source_nodes
+            del self._resp_cache[cache_key]
+
         agent, memory, source_nodes = await self._create_agent(file_ids, top_k, user_id)
         
         # 使用 Mem0 记忆进行对话
@@ -281,7 +514,12 @@ class AgentService:
             handler = agent.run(user_msg=message, chat_history=[])
         
         output = await handler
-        
+
+        # 写入响应缓存并按 LRU 淘汰最旧条目
+        self._resp_cache[cache_key] = (output, source_nodes, now + self._RESP_CACHE_TTL)
+        while len(self._resp_cache) > self._RESP_CACHE_MAX:
+            self._resp_cache.popitem(last=False)
+
         # output 是 AgentOutput 对象，返回 output 和 source_nodes
         return output, source_nodes
     
@@ -309,9 +547,12 @@ class AgentService:
                 - data: 相应的数据内容
         """
         source_nodes = []  # 本次请求的源节点
-        
+
         try:
-            agent, memory, source_nodes = await self._create_agent(file_ids, top_k, user_id)
+            # 流式路径传入 prefetch_query：检索与 LLM 首次规划并行，降低首 token 延迟
+            agent, memory, source_nodes = await self._create_agent(
+                file_ids, top_k, user_id, prefetch_query=message
+            )
             
             # 使用 Mem0 记忆进行对话
             if memory:
@@ -342,22 +583,17 @@ class AgentService:
             # 等待完成
             await handler
             
-            # 发送源信息
+            # 发送源信息（与非流式路径同构：截断文本 + node_id，
+            # 完整片段由前端通过 /chat/source/{node_id} 按需获取）
             if source_nodes:
                 logger.info(f"流式输出：获取到 {len(source_nodes)} 个源片段")
-                sources = []
-                for node in source_nodes:
-                    source_data = {
-                        "text": node.text,
-                        "score": float(node.score) if hasattr(node, 'score') else 0.0,
-                        "filename": node.metadata.get("filename", "未知"),
-                        "file_id": node.metadata.get("file_id", "")
-                    }
-                    sources.append(source_data)
-                
                 yield {
                     "type": "sources",
-                    "data": {"sources": sources}
+                    "data": {
+                        "sources": build_sources(
+                            source_nodes, settings.SOURCE_TEXT_MAX_CHARS
+                        )
+                    }
                 }
             
             # 发送完成信号
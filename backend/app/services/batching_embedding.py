@@ -0,0 +1,139 @@
+"""
+嵌入请求微批处理 - 把并发的零散嵌入请求合并为一次批量 API 调用
+
+并发场景下（多个 agent 工具调用同时检索、预取与实时查询同时在途、
+多文件并行摄取），每段文本各自发起一次 POST /embeddings，N 个并发
+请求就是 N 次 TLS + API 往返。本包装器在客户端做微批：短时间窗口内
+到达的文本攒成一批，一次批量调用底层模型，按序兑现各自的 Future。
+"""
+import asyncio
+from typing import List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """微批量嵌入包装器
+
+    异步嵌入调用不直接发 HTTP，而是入队并等待 Future；后台协程收到
+    首个文本后最多等待 max_wait_ms 毫秒（或攒满 batch_size 条即刻
+    冲刷），把整批文本合并为底层模型的一次批量调用。批量接口本身
+    （如摄取流水线的 aget_text_embedding_batch）入队时瞬间填满队列，
+    不受等待窗口影响。同步方法不经过队列，直接透传给底层模型。
+
+    攒满的批次派发为独立任务并发执行（在途上限 max_concurrency），
+    收集协程立即回去攒下一批：摄取流水线的多个并发批量调用仍然并行
+    在途，微批层不会把它们串行化成单条 HTTP 管道。
+
+    查询与文档共用同一批次：OpenAI 嵌入模型对两者使用相同的编码路径，
+    合并不影响结果。
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _queue: Optional[asyncio.Queue] = PrivateAttr()
+    _worker: Optional[asyncio.Task] = PrivateAttr()
+    _sem: Optional[asyncio.Semaphore] = PrivateAttr()
+    _inflight: set = PrivateAttr()
+    _batch_size: int = PrivateAttr()
+    _max_wait: float = PrivateAttr()
+    _max_concurrency: int = PrivateAttr()
+
+    def __init__(
+        self,
+        inner: BaseEmbedding,
+        batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        max_concurrency: int = 8,
+        **kwargs,
+    ):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        # 队列与后台协程在首次异步调用时创建，绑定到当时运行的事件循环
+        self._queue = None
+        self._worker = None
+        self._sem = None
+        self._inflight = set()  # 强引用在途任务，防止被垃圾回收
+        self._batch_size = batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._max_concurrency = max_concurrency
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchingEmbedding"
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._sem = asyncio.Semaphore(self._max_concurrency)
+            self._worker = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 阻塞等待首个条目，之后在等待窗口内继续收集
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # 批次派发为独立任务后立即回去攒下一批；信号量限制在途请求数，
+            # 避免把底层 API 打穿
+            await self._sem.acquire()
+            task = loop.create_task(self._embed_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _embed_batch(self, batch):
+        try:
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await self._inner._aget_text_embeddings(texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), embedding in zip(batch, embeddings):
+                    if not future.done():
+                        future.set_result(embedding)
+        finally:
+            self._sem.release()
+
+    async def _submit(self, text: str) -> List[float]:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    # --- 异步路径：经由微批队列 ---
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._submit(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self._submit(text)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*[self._submit(t) for t in texts]))
+
+    # --- 同步路径：无事件循环可用，直接透传 ---
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._inner._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._inner._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._inner._get_text_embeddings(texts)
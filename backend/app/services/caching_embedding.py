@@ -0,0 +1,169 @@
+"""
+嵌入结果缓存 - 对重复文本的嵌入请求做记忆化
+
+同一查询串在多个路径上会被反复嵌入（语义缓存查找、检索工具、预取、
+用户重复提问），每次都是一个完整的 OpenAI HTTPS 往返。包一层 LRU
+缓存后，重复文本的嵌入变成一次 dict 查找。
+"""
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+import hashlib
+import sqlite3
+import threading
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+class CachingEmbedding(BaseEmbedding):
+    """带 LRU 缓存的嵌入模型包装器（线程安全）
+
+    以 sha1(模型名 + 模式 + 文本) 为键缓存嵌入向量：键含模型名，换模型后
+    旧向量不会被误用；query/text 两种模式分开缓存（某些模型对查询和文档
+    使用不同前缀）。值以 float32 的 array.array 存储，相比 Python float
+    列表内存减半（1536 维从约 12KB 降到 6KB）。对批量接口只把未命中的
+    文本发给底层模型，命中部分零开销。
+
+    可选的 SQLite 持久层（db_path）：内存未命中时回查磁盘，写入时同步
+    落盘，重启/热重载后的冷启动不再重新嵌入整个语料。单行主键查询在
+    WAL 模式下是微秒级，相比它省下的数百毫秒 HTTPS 往返可以忽略。
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: OrderedDict = PrivateAttr()
+    _cache_lock: threading.Lock = PrivateAttr()
+    _maxsize: int = PrivateAttr()
+    _key_prefix: bytes = PrivateAttr()
+    _db: Optional[sqlite3.Connection] = PrivateAttr()
+
+    def __init__(
+        self,
+        inner: BaseEmbedding,
+        maxsize: int = 10000,
+        db_path: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._maxsize = maxsize
+        self._key_prefix = inner.model_name.encode() + b"\0"
+        self._db = None
+        if db_path:
+            # check_same_thread=False + _cache_lock 串行化访问：
+            # 同步嵌入路径可能在线程池里调用
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS emb_cache (key BLOB PRIMARY KEY, vec BLOB)"
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.commit()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachingEmbedding"
+
+    def _key(self, mode: str, text: str) -> bytes:
+        return hashlib.sha1(
+            self._key_prefix + mode.encode() + b"\0" + text.encode()
+        ).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[List[float]]:
+        with self._cache_lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+                return list(vec)
+            if self._db is None:
+                return None
+            # 内存未命中时回查磁盘，命中则回填内存 LRU
+            row = self._db.execute(
+                "SELECT vec FROM emb_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            compact = array("f")
+            compact.frombytes(row[0])
+            self._cache[key] = compact
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+            return list(compact)
+
+    def _cache_put(self, key: bytes, vec: List[float]):
+        compact = array("f", vec)
+        with self._cache_lock:
+            self._cache[key] = compact
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO emb_cache VALUES (?, ?)",
+                    (key, compact.tobytes()),
+                )
+                self._db.commit()
+
+    # --- 查询嵌入 ---
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        key = self._key("q", query)
+        vec = self._cache_get(key)
+        if vec is None:
+            vec = self._inner._get_query_embedding(query)
+            self._cache_put(key, vec)
+        return vec
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        key = self._key("q", query)
+        vec = self._cache_get(key)
+        if vec is None:
+            vec = await self._inner._aget_query_embedding(query)
+            self._cache_put(key, vec)
+        return vec
+
+    # --- 文档嵌入 ---
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        key = self._key("t", text)
+        vec = self._cache_get(key)
+        if vec is None:
+            vec = self._inner._get_text_embedding(text)
+            self._cache_put(key, vec)
+        return vec
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        key = self._key("t", text)
+        vec = self._cache_get(key)
+        if vec is None:
+            vec = await self._inner._aget_text_embedding(text)
+            self._cache_put(key, vec)
+        return vec
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("t", t) for t in texts]
+        results = [self._cache_get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            vecs = self._inner._get_text_embeddings([texts[i] for i in missing])
+            for i, vec in zip(missing, vecs):
+                results[i] = vec
+                self._cache_put(keys[i], vec)
+        return results
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("t", t) for t in texts]
+        results = [self._cache_get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            vecs = await self._inner._aget_text_embeddings([texts[i] for i in missing])
+            for i, vec in zip(missing, vecs):
+                results[i] = vec
+                self._cache_put(keys[i], vec)
+        return results
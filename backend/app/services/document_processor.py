@@ -1,6 +1,8 @@
 from llama_index.core import Document, Settings
 from llama_index.core.node_parser import SentenceSplitter
 from typing import List, Optional, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import os
 import logging
 from pathlib import Path
@@ -11,6 +13,82 @@ import threading
 logger = logging.getLogger(__name__)
 
 
+# 读取器工厂：functools.cache 首次调用后退化为一次 C 层字典查找，
+# 替代原先每次取用都要走的 dict 成员检查 + threading.Lock 双重检查
+@functools.cache
+def _pdf_reader():
+    """获取PDF读取器（进程内共享，懒加载）"""
+    try:
+        from llama_index.readers.file import PyMuPDFReader
+        logger.info("已加载 PyMuPDFReader 用于PDF解析")
+        return PyMuPDFReader()
+    except ImportError:
+        logger.warning("PyMuPDFReader 不可用，将使用默认PDF解析器")
+        return None
+
+
+@functools.cache
+def _docx_reader():
+    """获取Word文档读取器（进程内共享，懒加载）"""
+    try:
+        from llama_index.readers.file import DocxReader
+        logger.info("已加载 DocxReader 用于Word文档解析")
+        return DocxReader()
+    except ImportError:
+        logger.warning("DocxReader 不可用，将使用默认解析器")
+        return None
+
+
+@functools.cache
+def _legacy_office_reader():
+    """获取旧版Office文档读取器（.doc文件，进程内共享，懒加载）
+
+    注意: 需要安装 llama-index-readers-legacy-office 包和 Java 运行环境
+    安装方法: uv pip install llama-index-readers-legacy-office
+    """
+    try:
+        from llama_index.readers.legacy_office import LegacyOfficeReader  # type: ignore
+        logger.info("已加载 LegacyOfficeReader 用于.doc文件解析")
+        return LegacyOfficeReader()
+    except ImportError:
+        logger.warning("LegacyOfficeReader 不可用，.doc文件可能无法解析")
+        return None
+
+
+@functools.cache
+def _excel_reader():
+    """获取Excel读取器（进程内共享，懒加载）"""
+    try:
+        from llama_index.readers.file import PandasExcelReader
+        logger.info("已加载 PandasExcelReader 用于Excel解析")
+        return PandasExcelReader()
+    except ImportError:
+        logger.warning("PandasExcelReader 不可用，将使用pandas直接读取")
+        return None
+
+
+@functools.cache
+def _pptx_reader():
+    """获取PowerPoint读取器（进程内共享，懒加载）"""
+    try:
+        from llama_index.readers.file import PptxReader
+        logger.info("已加载 PptxReader 用于PowerPoint解析")
+        return PptxReader()
+    except ImportError:
+        logger.warning("PptxReader 不可用，将使用默认解析器")
+        return None
+
+
+def _extract_pdf_pages(file_path: str, page_indices: List[int]) -> List[str]:
+    """在子进程中提取一段连续 PDF 页面的文本（进程池工作函数，需可 pickle）"""
+    import fitz
+    texts = []
+    with fitz.open(file_path) as pdf:
+        for idx in page_indices:
+            texts.append(pdf.load_page(idx).get_text())
+    return texts
+
+
 class DocumentProcessor:
     """
     生产级文档处理器
@@ -38,7 +116,15 @@ class DocumentProcessor:
         # 其他
         'other': ['.json', '.html', '.xml', '.epub']
     }
-    
+
+    # 扁平化的 扩展名 → 类型 映射，类型判断从遍历所有列表变为一次 dict 查找
+    _EXT_TO_TYPE = {
+        ext: doc_type
+        for doc_type, extensions in SUPPORTED_EXTENSIONS.items()
+        for ext in extensions
+    }
+    _ALL_EXTS = frozenset(_EXT_TO_TYPE)
+
     def __init__(
         self,
         chunk_size: int = 1024,
@@ -63,101 +149,70 @@ class DocumentProcessor:
             chunk_overlap=chunk_overlap,
         )
         
-        # 延迟加载读取器（避免不必要的导入）
-        self._readers = {}
-        self._readers_lock = threading.Lock()  # 保护 _readers 字典的锁（使用线程锁因为读取器加载是同步的）
-        
-    def _get_pdf_reader(self):
-        """获取PDF读取器（线程安全）"""
-        # 快速路径：如果已加载，直接返回
-        if 'pdf' in self._readers:
-            return self._readers['pdf']
-        
-        # 使用锁保护加载过程
-        with self._readers_lock:
-            # 双重检查，避免重复加载
-            if 'pdf' not in self._readers:
-                try:
-                    from llama_index.readers.file import PyMuPDFReader
-                    self._readers['pdf'] = PyMuPDFReader()
-                    logger.info("已加载 PyMuPDFReader 用于PDF解析")
-                except ImportError:
-                    logger.warning("PyMuPDFReader 不可用，将使用默认PDF解析器")
-                    self._readers['pdf'] = None
-            return self._readers['pdf']
-    
-    def _get_docx_reader(self):
-        """获取Word文档读取器（线程安全）"""
-        if 'docx' in self._readers:
-            return self._readers['docx']
-        
-        with self._readers_lock:
-            if 'docx' not in self._readers:
-                try:
-                    from llama_index.readers.file import DocxReader
-                    self._readers['docx'] = DocxReader()
-                    logger.info("已加载 DocxReader 用于Word文档解析")
-                except ImportError:
-                    logger.warning("DocxReader 不可用，将使用默认解析器")
-                    self._readers['docx'] = None
-            return self._readers['docx']
-    
-    def _get_legacy_office_reader(self):
-        """
-        获取旧版Office文档读取器（.doc文件）（线程安全）
-        
-        注意: 需要安装 llama-index-readers-legacy-office 包和 Java 运行环境
-        安装方法: uv pip install llama-index-readers-legacy-office
+        # PDF 按页并行解析用的进程池（懒创建，fork 成本只付一次）
+        self._pdf_pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()  # 保护进程池的懒创建
+
+    # 页数达到该阈值的 PDF 才走进程池（小文件并行收益抵不过任务分发开销）
+    _PDF_PARALLEL_MIN_PAGES = 16
+
+    def _get_pdf_pool(self) -> ProcessPoolExecutor:
+        """获取 PDF 解析进程池（线程安全，懒创建）"""
+        if self._pdf_pool is None:
+            with self._pool_lock:
+                if self._pdf_pool is None:
+                    self._pdf_pool = ProcessPoolExecutor(
+                        max_workers=min(4, os.cpu_count() or 1)
+                    )
+        return self._pdf_pool
+
+    def _parse_pdf_parallel(self, file_path: str) -> Optional[List[Document]]:
+        """按页并行解析 PDF
+
+        页面相互独立，切成与 worker 数相当的连续区段分发到子进程，
+        每个子进程只打开一次文件。fitz 不可用或页数太少时返回 None，
+        由调用方回退到串行路径。
         """
-        if 'legacy_office' in self._readers:
-            return self._readers['legacy_office']
-        
-        with self._readers_lock:
-            if 'legacy_office' not in self._readers:
-                try:
-                    from llama_index.readers.legacy_office import LegacyOfficeReader  # type: ignore
-                    self._readers['legacy_office'] = LegacyOfficeReader()
-                    logger.info("已加载 LegacyOfficeReader 用于.doc文件解析")
-                except ImportError:
-                    logger.warning("LegacyOfficeReader 不可用，.doc文件可能无法解析")
-                    self._readers['legacy_office'] = None
-            return self._readers['legacy_office']
-    
-    def _get_excel_reader(self):
-        """获取Excel读取器（线程安全）"""
-        if 'excel' in self._readers:
-            return self._readers['excel']
-        
-        with self._readers_lock:
-            if 'excel' not in self._readers:
-                try:
-                    from llama_index.readers.file import PandasExcelReader
-                    self._readers['excel'] = PandasExcelReader()
-                    logger.info("已加载 PandasExcelReader 用于Excel解析")
-                except ImportError:
-                    logger.warning("PandasExcelReader 不可用，将使用pandas直接读取")
-                    self._readers['excel'] = None
-            return self._readers['excel']
-    
-    def _get_pptx_reader(self):
-        """获取PowerPoint读取器（线程安全）"""
-        if 'pptx' in self._readers:
-            return self._readers['pptx']
-        
-        with self._readers_lock:
-            if 'pptx' not in self._readers:
-                try:
-                    from llama_index.readers.file import PptxReader
-                    self._readers['pptx'] = PptxReader()
-                    logger.info("已加载 PptxReader 用于PowerPoint解析")
-                except ImportError:
-                    logger.warning("PptxReader 不可用，将使用默认解析器")
-                    self._readers['pptx'] = None
-            return self._readers['pptx']
-    
+        try:
+            import fitz
+        except ImportError:
+            return None
+
+        with fitz.open(file_path) as pdf:
+            page_count = pdf.page_count
+        if page_count < self._PDF_PARALLEL_MIN_PAGES:
+            return None
+
+        pool = self._get_pdf_pool()
+        workers = pool._max_workers
+        step = (page_count + workers - 1) // workers
+        segments = [
+            list(range(start, min(start + step, page_count)))
+            for start in range(0, page_count, step)
+        ]
+        futures = [pool.submit(_extract_pdf_pages, file_path, seg) for seg in segments]
+        texts: List[str] = []
+        for future in futures:
+            texts.extend(future.result())
+
+        metadata = self._extract_metadata(file_path)
+        documents = [
+            Document(text=text, metadata={**metadata, 'page_label': str(idx + 1)})
+            for idx, text in enumerate(texts)
+        ]
+        logger.info(f"进程池并行解析PDF: {file_path}（{page_count} 页，{len(segments)} 个区段）")
+        return documents
+
     def _parse_pdf(self, file_path: str) -> List[Document]:
-        """解析PDF文档"""
-        reader = self._get_pdf_reader()
+        """解析PDF文档（多页大文件按页并行，失败时回退串行读取器）"""
+        try:
+            documents = self._parse_pdf_parallel(file_path)
+            if documents is not None:
+                return documents
+        except Exception as e:
+            logger.error(f"并行解析PDF失败: {e}，回退到串行解析器")
+
+        reader = _pdf_reader()
         if reader:
             try:
                 documents = reader.load_data(file_path=file_path)
@@ -175,7 +230,7 @@ class DocumentProcessor:
         
         # .doc 文件使用 LegacyOfficeReader
         if ext == '.doc':
-            reader = self._get_legacy_office_reader()
+            reader = _legacy_office_reader()
             if reader:
                 try:
                     documents = reader.load_data(file=Path(file_path))
@@ -186,7 +241,7 @@ class DocumentProcessor:
         
         # .docx 文件使用 DocxReader
         else:
-            reader = self._get_docx_reader()
+            reader = _docx_reader()
             if reader:
                 try:
                     documents = reader.load_data(file=Path(file_path))
@@ -207,7 +262,7 @@ class DocumentProcessor:
             return self._parse_with_simple_reader(file_path, ['.csv'])
         
         # Excel文件使用专用读取器
-        reader = self._get_excel_reader()
+        reader = _excel_reader()
         if reader:
             try:
                 documents = reader.load_data(file=Path(file_path))
@@ -233,7 +288,7 @@ class DocumentProcessor:
     
     def _parse_powerpoint(self, file_path: str) -> List[Document]:
         """解析PowerPoint文档"""
-        reader = self._get_pptx_reader()
+        reader = _pptx_reader()
         if reader:
             try:
                 documents = reader.load_data(file=Path(file_path))
@@ -246,32 +301,47 @@ class DocumentProcessor:
         return self._parse_with_simple_reader(file_path, ['.pptx', '.ppt'])
     
     def _parse_text(self, file_path: str) -> List[Document]:
-        """解析文本文档"""
+        """解析文本文档
+
+        只读一次磁盘：原先按 utf-8/gbk/gb2312/latin-1 逐个编码重新打开并
+        重读整个文件，对大日志最多 4 倍 I/O；现在一次读入字节后全部在
+        内存中解码尝试。
+        """
+        with open(file_path, 'rb') as f:
+            data = f.read()
+
+        text = None
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-            
-            doc = Document(
-                text=text,
-                metadata=self._extract_metadata(file_path)
-            )
+            text = data.decode('utf-8')
             logger.info(f"成功解析文本文件: {file_path}")
-            return [doc]
         except UnicodeDecodeError:
-            # 尝试其他编码
-            for encoding in ['gbk', 'gb2312', 'latin-1']:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        text = f.read()
-                    doc = Document(
-                        text=text,
-                        metadata=self._extract_metadata(file_path)
-                    )
-                    logger.info(f"使用 {encoding} 编码成功解析文本文件: {file_path}")
-                    return [doc]
-                except:
-                    continue
+            # 优先用 charset_normalizer 嗅探编码（可选依赖），否则按常见编码兜底
+            try:
+                from charset_normalizer import from_bytes
+                best = from_bytes(data).best()
+                if best is not None:
+                    text = str(best)
+                    logger.info(f"使用嗅探到的 {best.encoding} 编码成功解析文本文件: {file_path}")
+            except ImportError:
+                pass
+
+            if text is None:
+                for encoding in ('gbk', 'gb2312', 'latin-1'):
+                    try:
+                        text = data.decode(encoding)
+                        logger.info(f"使用 {encoding} 编码成功解析文本文件: {file_path}")
+                        break
+                    except UnicodeDecodeError:
+                        continue
+
+        if text is None:
             raise ValueError(f"无法解析文本文件（编码问题）: {file_path}")
+
+        doc = Document(
+            text=text,
+            metadata=self._extract_metadata(file_path)
+        )
+        return [doc]
     
     def _parse_with_simple_reader(self, file_path: str, required_exts: List[str]) -> List[Document]:
         """使用SimpleDirectoryReader解析文档"""
@@ -295,29 +365,20 @@ class DocumentProcessor:
         if not self.enable_metadata:
             return {}
         
-        metadata = {
+        # 一次 stat 系统调用拿到大小和时间戳（getsize 内部也是 stat）
+        stat = os.stat(file_path)
+        return {
             'file_path': file_path,
             'file_name': os.path.basename(file_path),
-            'file_size': os.path.getsize(file_path),
+            'file_size': stat.st_size,
             'file_extension': self.get_file_extension(file_path),
+            'created_at': stat.st_ctime,
+            'modified_at': stat.st_mtime,
         }
-        
-        # 添加文件时间戳
-        stat = os.stat(file_path)
-        metadata['created_at'] = stat.st_ctime
-        metadata['modified_at'] = stat.st_mtime
-        
-        return metadata
     
     def _determine_document_type(self, file_path: str) -> Optional[str]:
         """判断文档类型"""
-        ext = self.get_file_extension(file_path)
-        
-        for doc_type, extensions in self.SUPPORTED_EXTENSIONS.items():
-            if ext in extensions:
-                return doc_type
-        
-        return None
+        return self._EXT_TO_TYPE.get(self.get_file_extension(file_path))
     
     async def process_file(self, file_path: str) -> List[Document]:
         """
@@ -332,7 +393,8 @@ class DocumentProcessor:
         Raises:
             ValueError: 文件不支持或解析失败
         """
-        if not os.path.exists(file_path):
+        # 存在性检查也走线程池：NFS/overlay 等慢存储上的 stat 同样会阻塞事件循环
+        if not await asyncio.to_thread(os.path.exists, file_path):
             raise ValueError(f"文件不存在: {file_path}")
         
         # 判断文档类型
@@ -344,18 +406,23 @@ class DocumentProcessor:
         logger.info(f"开始处理文件: {file_path} (类型: {doc_type})")
         
         # 根据文档类型选择解析方法
+        # 解析器（PyMuPDF/pandas/DocxReader 等）全是同步阻塞调用，
+        # 放到线程池执行：事件循环在解析期间继续服务 HTTP 流量，
+        # 多个文件的解析得以并发进行
         try:
             if doc_type == 'pdf':
-                documents = self._parse_pdf(file_path)
+                documents = await asyncio.to_thread(self._parse_pdf, file_path)
             elif doc_type == 'word':
-                documents = self._parse_word(file_path)
+                documents = await asyncio.to_thread(self._parse_word, file_path)
             elif doc_type == 'excel':
-                documents = self._parse_excel(file_path)
+                documents = await asyncio.to_thread(self._parse_excel, file_path)
             elif doc_type == 'powerpoint':
-                documents = self._parse_powerpoint(file_path)
+                documents = await asyncio.to_thread(self._parse_powerpoint, file_path)
             else:  # 其他类型使用默认解析器
                 ext = self.get_file_extension(file_path)
-                documents = self._parse_with_simple_reader(file_path, [ext])
+                documents = await asyncio.to_thread(
+                    self._parse_with_simple_reader, file_path, [ext]
+                )
             
             # 添加额外的元数据
             for doc in documents:
@@ -369,7 +436,18 @@ class DocumentProcessor:
         except Exception as e:
             logger.error(f"处理文件失败: {file_path}，错误: {str(e)}")
             raise
-    
+
+    async def process_files(self, file_paths: List[str]) -> List[List[Document]]:
+        """并发处理多个文件
+
+        各文件的解析在线程池中并行执行，整体耗时接近最慢的单个文件
+        而不是所有文件之和。
+
+        Returns:
+            与 file_paths 等长的列表，每项为该文件解析出的文档列表
+        """
+        return await asyncio.gather(*[self.process_file(p) for p in file_paths])
+
     @staticmethod
     def get_file_extension(filename: str) -> str:
         """获取文件扩展名"""
@@ -378,17 +456,13 @@ class DocumentProcessor:
     @classmethod
     def get_all_supported_extensions(cls) -> List[str]:
         """获取所有支持的文件扩展名"""
-        extensions = []
-        for ext_list in cls.SUPPORTED_EXTENSIONS.values():
-            extensions.extend(ext_list)
-        return extensions
-    
+        return list(cls._EXT_TO_TYPE)
+
     @staticmethod
     def is_supported_file(filename: str) -> bool:
         """检查文件是否支持"""
         ext = DocumentProcessor.get_file_extension(filename)
-        all_exts = DocumentProcessor.get_all_supported_extensions()
-        return ext in all_exts
+        return ext in DocumentProcessor._ALL_EXTS
 
 
 # 单例实例（依赖注入模式）
@@ -0,0 +1,177 @@
+"""
+语义查询缓存 - 基于向量相似度短路重复查询
+
+对近似重复的查询（余弦相似度超过阈值），直接返回缓存的结果，
+避免完整的 LLM + 检索往返（通常数秒），缓存命中只需一次向量点积（约 1ms）。
+
+特性：
+- 按 key（如 (user_id, frozenset(file_ids))）精确隔离，向量相似度模糊匹配
+- LRU + TTL 淘汰，容量有界
+- 文件上传/删除时按 file_id 失效相关条目
+"""
+import threading
+import time
+from typing import Any, FrozenSet, Hashable, List, Optional
+
+import numpy as np
+
+from ..config import settings
+from ..logger import logger
+
+
+class SemanticCache:
+    """语义缓存（线程安全）
+
+    内部维护一个 int8 量化的向量矩阵 (N, d)：嵌入先 L2 归一化，
+    再按固定比例 127 量化（归一化后分量幅值 ≈ 1，量化误差可忽略）。
+    相比 float32 内存带宽减少 4 倍，点积走整型路径更快。
+    查询时用一次矩阵-向量点积计算所有缓存条目的近似余弦相似度。
+    """
+
+    # int8 量化比例：归一化向量分量乘以 127 取整
+    _QUANT_SCALE = 127.0
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        ttl: float = 300.0,
+        maxsize: int = 256,
+    ):
+        """
+        Args:
+            threshold: 余弦相似度命中阈值
+            ttl: 条目存活时间（秒）
+            maxsize: 最大条目数（LRU 淘汰）
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self._lock = threading.RLock()
+        # 每个条目: [key, int8 量化向量, payload, 过期时间, 关联的 file_ids]
+        self._entries: List[list] = []
+        # 与 _entries 平行的 int8 矩阵，形状 (N, d)，用于单次点积
+        self._matrix: Optional[np.ndarray] = None
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def _quantize(cls, embedding) -> np.ndarray:
+        """L2 归一化后量化为 int8 向量"""
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return np.round(vec * cls._QUANT_SCALE).clip(-128, 127).astype(np.int8)
+
+    def _rebuild_matrix(self):
+        """重建向量矩阵（在持有锁时调用）"""
+        if self._entries:
+            self._matrix = np.vstack([e[1] for e in self._entries])
+        else:
+            self._matrix = None
+
+    def _prune_expired(self):
+        """清理过期条目（在持有锁时调用）"""
+        now = time.monotonic()
+        alive = [e for e in self._entries if e[3] > now]
+        if len(alive) != len(self._entries):
+            self._entries = alive
+            self._rebuild_matrix()
+
+    def get(self, key: Hashable, embedding) -> Optional[Any]:
+        """查找缓存
+
+        Args:
+            key: 精确匹配的缓存键（如 (user_id, frozenset(file_ids))）
+            embedding: 查询向量
+
+        Returns:
+            命中时返回缓存的 payload，否则返回 None
+        """
+        query_vec = self._quantize(embedding)
+
+        with self._lock:
+            self._prune_expired()
+            if self._matrix is None:
+                self.misses += 1
+                return None
+
+            # 一次整型点积得到所有条目的近似余弦相似度（int32 累加防溢出）
+            sims = (self._matrix @ query_vec.astype(np.int32)) / (self._QUANT_SCALE ** 2)
+
+            best_idx = -1
+            best_sim = self.threshold
+            for i, entry in enumerate(self._entries):
+                if entry[0] == key and sims[i] >= best_sim:
+                    best_sim = sims[i]
+                    best_idx = i
+
+            if best_idx < 0:
+                self.misses += 1
+                return None
+
+            # LRU: 命中条目移到末尾
+            entry = self._entries.pop(best_idx)
+            self._entries.append(entry)
+            self._rebuild_matrix()
+            self.hits += 1
+            logger.info("语义缓存命中 (相似度: %.4f)", float(best_sim))
+            return entry[2]
+
+    def put(
+        self,
+        key: Hashable,
+        embedding,
+        payload: Any,
+        file_ids: Optional[FrozenSet[str]] = None,
+    ):
+        """写入缓存"""
+        vec = self._quantize(embedding)
+        expires_at = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._entries.append([key, vec, payload, expires_at, file_ids or frozenset()])
+            # LRU 淘汰最旧的条目
+            while len(self._entries) > self.maxsize:
+                self._entries.pop(0)
+            self._rebuild_matrix()
+
+    def invalidate(self, file_id: str):
+        """失效与指定文件相关的所有条目（文件上传/删除时调用）"""
+        with self._lock:
+            before = len(self._entries)
+            self._entries = [e for e in self._entries if file_id not in e[4]]
+            if len(self._entries) != before:
+                self._rebuild_matrix()
+                logger.info("语义缓存失效 %d 个条目 (file_id: %s)", before - len(self._entries), file_id)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+
+
+# 单例实例（依赖注入模式）
+_semantic_cache: Optional[SemanticCache] = None
+
+def get_semantic_cache() -> SemanticCache:
+    """
+    获取 SemanticCache 单例（依赖注入模式）
+
+    特性：
+    - 延迟初始化：只在首次使用时创建
+    - 单例模式：应用生命周期内只有一个实例
+    - 易于测试：可以通过 FastAPI dependency_overrides 替换
+    """
+    global _semantic_cache
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache(
+            threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+            ttl=settings.SEMANTIC_CACHE_TTL,
+            maxsize=settings.SEMANTIC_CACHE_MAXSIZE,
+        )
+    return _semantic_cache
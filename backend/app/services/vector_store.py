@@ -1,8 +1,10 @@
 from llama_index.core import VectorStoreIndex, StorageContext, Settings, Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
-from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models as qmodels
 from motor.motor_asyncio import AsyncIOMotorClient
 from typing import List, Dict, Optional
@@ -13,41 +15,102 @@ import asyncio
 
 from ..config import settings as app_settings
 from ..logger import logger
+from .batching_embedding import BatchingEmbedding
+from .caching_embedding import CachingEmbedding
+
+# 已知嵌入模型的向量维度；未登记的模型在启动时显式报错，
+# 而不是默默按 1536 建集合导致后续所有 upsert 失败
+_EMBED_DIM = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+_mongo_client: Optional[AsyncIOMotorClient] = None
+
+def get_mongo_client() -> AsyncIOMotorClient:
+    """进程内共享的 MongoDB 客户端
+
+    Motor 客户端自带连接池和后台监控线程，重复构造会成倍增加文件
+    描述符与线程数；整个进程（单事件循环）共用一个实例即可。
+    """
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = AsyncIOMotorClient(app_settings.MONGO_URI)
+    return _mongo_client
+
+
+_llm_settings_configured = False
+
+def configure_llm_settings():
+    """配置全局 LlamaIndex Settings（嵌入模型 / LLM），幂等
+
+    从 VectorStoreService.__init__ 中拆出：应用启动时在 lifespan 里显式
+    调用，全局 Settings 的写入时机不再隐式取决于第一次构造服务的位置；
+    脚本/测试也可以单独配置 Settings 而不必连带建立 Qdrant/MongoDB 连接。
+    """
+    global _llm_settings_configured
+    if _llm_settings_configured:
+        return
+
+    # 嵌入模型两层包装：外层 LRU 缓存（重复文本只产生一次往返），
+    # 内层微批合并（并发的零散未命中在 5ms 窗口内攒成一次批量调用）
+    Settings.embed_model = CachingEmbedding(
+        inner=BatchingEmbedding(
+            inner=OpenAIEmbedding(
+                model=app_settings.OPENAI_EMBEDDING_MODEL,
+                api_key=app_settings.OPENAI_API_KEY,
+                api_base=app_settings.OPENAI_API_BASE,
+                # 单次嵌入请求最多携带 256 段文本，减少摄取时的 HTTPS 往返数
+                embed_batch_size=256,
+            ),
+        ),
+        maxsize=app_settings.EMBEDDING_CACHE_CAPACITY,
+        # SQLite 持久层：重启/热重载后已嵌入的文本不再重新请求 OpenAI
+        db_path=app_settings.EMBEDDING_CACHE_DB or None,
+    )
+
+    Settings.llm = OpenAI(
+        temperature=0.1,
+        model=app_settings.OPENAI_MODEL,
+        api_key=app_settings.OPENAI_API_KEY,
+        api_base=app_settings.OPENAI_API_BASE,
+    )
+
+    # 节点切分器显式构造一次（tokenizer 预热有数十毫秒成本），
+    # 摄取路径复用 Settings.node_parser，不再依赖默认值的隐式惰性创建
+    Settings.node_parser = SentenceSplitter(chunk_size=1024, chunk_overlap=200)
+
+    _llm_settings_configured = True
+
 
 class VectorStoreService:
     """向量存储服务 - 负责管理文档和向量"""
-    
+
     def __init__(self):
+        # prefer_grpc：走多路复用的 gRPC 传输而非 HTTP/1.1。
+        # HTTP/1.1 下每个在途请求独占一条连接，并发检索时连接池耗尽会
+        # 相互排队；gRPC 在单条连接上多路复用，并发查询不再串行化。
+        # 只建异步客户端：服务内所有向量操作都走异步路径，
+        # 不再为同一 host/port 维护第二套同步连接池
         self.qdrant_client = AsyncQdrantClient(
             host=app_settings.QDRANT_HOST,
-            port=app_settings.QDRANT_PORT
-        )
-        self.sync_qdrant_client = QdrantClient(
-            host=app_settings.QDRANT_HOST,
-            port=app_settings.QDRANT_PORT
+            port=app_settings.QDRANT_PORT,
+            grpc_port=app_settings.QDRANT_GRPC_PORT,
+            prefer_grpc=True,
         )
         
-        # MongoDB Client
-        self.mongo_client = AsyncIOMotorClient(app_settings.MONGO_URI)
+        # MongoDB Client（进程级共享，见 get_mongo_client）
+        self.mongo_client = get_mongo_client()
         self.db = self.mongo_client[app_settings.MONGO_DB]
         self.metadata_collection = self.db[app_settings.MONGO_COLLECTION_METADATA]
         
-        # 配置 LlamaIndex
-        Settings.embed_model = OpenAIEmbedding(
-            model=app_settings.OPENAI_EMBEDDING_MODEL,
-            api_key=app_settings.OPENAI_API_KEY,
-            api_base=app_settings.OPENAI_API_BASE,
-        )
-        
-        Settings.llm = OpenAI(
-            temperature=0.1,
-            model=app_settings.OPENAI_MODEL,
-            api_key=app_settings.OPENAI_API_KEY,
-            api_base=app_settings.OPENAI_API_BASE,
-        )
-        
+        # 确保全局 LlamaIndex Settings 已配置（lifespan 已调用时此处直接返回）
+        configure_llm_settings()
+
+        # 只传 aclient：同步入口（insert/query）不会被用到，
+        # 服务统一走 async_add / aquery
         self.vector_store = QdrantVectorStore(
-            client=self.sync_qdrant_client,
             aclient=self.qdrant_client,
             collection_name=app_settings.QDRANT_COLLECTION,
             enable_hybrid=False,
@@ -59,15 +122,24 @@ class VectorStoreService:
         )
         
         self.index: Optional[VectorStoreIndex] = None
-        self._index_lock = asyncio.Lock()  # 保护 index 的初始化和修改
-        
-    def _get_embedding_dim(self) -> int:
+        self._index_lock = asyncio.Lock()  # 仅保护 index 的双重检查初始化
+        # 文档库版本号：每次增删文件时自增，
+        # 供上层缓存（如 AgentService 的响应缓存）纳入缓存键实现自动失效
+        self.files_version = 0
+        # 构造期解析一次向量维度，未知模型在启动时就报错
+        self._embed_dim = self._get_embedding_dim()
+
+    @staticmethod
+    def _get_embedding_dim() -> int:
         """根据配置的模型名称获取向量维度"""
         model = app_settings.OPENAI_EMBEDDING_MODEL
-        if "text-embedding-3-large" in model:
-            return 3072
-        # text-embedding-3-small and text-embedding-ada-002 are 1536
-        return 1536
+        dim = _EMBED_DIM.get(model)
+        if dim is None:
+            raise ValueError(
+                f"未知的嵌入模型: {model}，无法确定向量维度；"
+                f"请在 _EMBED_DIM 中登记该模型"
+            )
+        return dim
 
     async def initialize(self):
         """初始化索引（线程安全）"""
@@ -87,13 +159,29 @@ class VectorStoreService:
                 
                 if not exists:
                     logger.info(f"集合不存在，创建新索引: {app_settings.QDRANT_COLLECTION}")
-                    vector_size = self._get_embedding_dim()
+                    vector_size = self._embed_dim
                     await self.qdrant_client.create_collection(
                         collection_name=app_settings.QDRANT_COLLECTION,
                         vectors_config=qmodels.VectorParams(
                             size=vector_size,
                             distance=qmodels.Distance.COSINE
-                        )
+                        ),
+                        # int8 标量量化：每维 4 字节降到 1 字节（1536 维单条
+                        # 向量 6KB → 1.5KB），量化副本常驻内存加速检索（检索
+                        # 是内存带宽瓶颈），原始 FP32 向量仍在磁盘上用于重打分，
+                        # 召回损失可忽略
+                        quantization_config=qmodels.ScalarQuantization(
+                            scalar=qmodels.ScalarQuantizationConfig(
+                                type=qmodels.ScalarType.INT8,
+                                always_ram=True,
+                            )
+                        ),
+                        # ef_construct 从默认 100 提到 128：建图时多探索一些
+                        # 邻居，换取更高的图质量（同等 hnsw_ef 下召回更好）；
+                        # m 与 full_scan_threshold 保持 Qdrant 默认值
+                        hnsw_config=qmodels.HnswConfigDiff(
+                            ef_construct=128,
+                        ),
                     )
                 else:
                     logger.info(f"已加载现有索引: {app_settings.QDRANT_COLLECTION}")
@@ -102,7 +190,37 @@ class VectorStoreService:
                     vector_store=self.vector_store,
                     storage_context=self.storage_context,
                 )
-                
+
+                # 为 file_id 声明 keyword payload 索引：按文件过滤的检索和
+                # 删除从 O(集合大小) 的全量 payload 扫描变为倒排索引查找。
+                # 两个字段名对应扁平与嵌套两种 metadata 存储布局
+                for field_name in ("file_id", "metadata.file_id"):
+                    try:
+                        await self.qdrant_client.create_payload_index(
+                            collection_name=app_settings.QDRANT_COLLECTION,
+                            field_name=field_name,
+                            field_schema=qmodels.PayloadSchemaType.KEYWORD,
+                        )
+                    except Exception:
+                        # 索引已存在（重启）或服务端不支持时忽略
+                        pass
+
+                # MongoDB 元数据索引：file_id 查删走索引而非集合扫描，
+                # uploaded_at 供文件列表的排序 + 分页使用（create_index 幂等）
+                try:
+                    await self.metadata_collection.create_index("file_id", unique=True)
+                    await self.metadata_collection.create_index([("uploaded_at", -1)])
+                    # 历史文档的 uploaded_at 是 ISO 字符串（旧版用 isoformat
+                    # 存储）；BSON 对字符串和 date 按类型分桶排序，混存会把
+                    # 所有旧文件排到新文件之后。启动时一次性回填为 BSON date，
+                    # 已迁移的部署匹配不到字符串条目，update_many 是空操作
+                    await self.metadata_collection.update_many(
+                        {"uploaded_at": {"$type": "string"}},
+                        [{"$set": {"uploaded_at": {"$toDate": "$uploaded_at"}}}],
+                    )
+                except Exception as e:
+                    logger.warning(f"创建元数据索引/回填上传时间失败: {e}")
+
             except Exception as e:
                 logger.error(f"初始化索引失败: {e}")
                 # 如果失败，尝试使用空文档列表初始化（作为后备方案）
@@ -115,103 +233,266 @@ class VectorStoreService:
                 except Exception as e2:
                     logger.error(f"后备初始化也失败: {e2}")
     
+    async def get_node_text(self, node_id: str) -> Optional[str]:
+        """根据节点ID获取完整片段文本（用于按需加载被截断的源片段）"""
+        try:
+            points = await self.qdrant_client.retrieve(
+                collection_name=app_settings.QDRANT_COLLECTION,
+                ids=[node_id],
+                with_payload=True,
+                with_vectors=False
+            )
+        except Exception as e:
+            logger.error(f"获取节点失败: {node_id}, {e}")
+            return None
+
+        if not points:
+            return None
+
+        payload = points[0].payload or {}
+        # LlamaIndex 将节点内容序列化存储在 _node_content 字段中
+        raw = payload.get("_node_content")
+        if raw:
+            try:
+                return json.loads(raw).get("text", "")
+            except (ValueError, AttributeError):
+                pass
+        return payload.get("text")
+
+    @staticmethod
+    def _file_filter(file_ids: Optional[List[str]]) -> Optional[qmodels.Filter]:
+        """构造按 file_id 过滤的 Qdrant Filter（OR 语义）"""
+        if not file_ids:
+            return None
+        return qmodels.Filter(
+            should=[
+                qmodels.FieldCondition(
+                    key="file_id",
+                    match=qmodels.MatchValue(value=fid)
+                )
+                for fid in file_ids
+            ]
+        )
+
+    async def aquery_batch(
+        self,
+        queries: List[str],
+        file_ids: Optional[List[str]] = None,
+        top_k: int = 3
+    ) -> List[List[qmodels.ScoredPoint]]:
+        """批量相似度检索
+
+        N 个查询合并为一次嵌入请求 + 一次 Qdrant query_batch_points 往返，
+        多查询场景（agent 连续多次工具调用、批量评估脚本）下避免逐查询的
+        /points/search HTTP 请求。
+
+        Returns:
+            与 queries 等长的列表，每项为该查询的 ScoredPoint 命中列表
+        """
+        if not queries:
+            return []
+
+        # 查询模式嵌入：与检索路径共用 CachingEmbedding 的查询键（避免同一
+        # 字符串按文档模式重复嵌入），且对查询/文档编码不同的模型语义正确；
+        # 并发的单条未命中由微批层合并为一次 POST
+        embeddings = await asyncio.gather(
+            *[Settings.embed_model.aget_query_embedding(q) for q in queries]
+        )
+        query_filter = self._file_filter(file_ids)
+        # hnsw_ef=64 对 top_k=3 已有充分召回，比默认值少访问约一半图节点
+        search_params = qmodels.SearchParams(hnsw_ef=64, exact=False)
+        requests = [
+            qmodels.QueryRequest(
+                query=embedding,
+                limit=top_k,
+                filter=query_filter,
+                params=search_params,
+                with_payload=True,
+            )
+            for embedding in embeddings
+        ]
+        responses = await self.qdrant_client.query_batch_points(
+            collection_name=app_settings.QDRANT_COLLECTION,
+            requests=requests,
+        )
+        return [response.points for response in responses]
+
+    async def find_file_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """根据内容哈希查找已存在的文件元数据（用于上传去重）"""
+        if not content_hash:
+            return None
+        return await self.metadata_collection.find_one(
+            {"content_hash": content_hash}, {"_id": 0}
+        )
+
     async def add_documents(
-        self, 
-        file_id: str, 
-        filename: str, 
+        self,
+        file_id: str,
+        filename: str,
+        documents: List[Document],
+        file_size: int,
+        content_hash: Optional[str] = None
+    ) -> int:
+        """添加文档到向量存储
+
+        旧接口保留签名以兼容调用方；逐文档 index.insert（每文档一次嵌入
+        请求 + 一次 Qdrant upsert）已废弃，统一委托给批量路径。
+        """
+        return await self.add_documents_batched(
+            file_id, filename, documents, file_size, content_hash=content_hash
+        )
+
+    async def add_documents_batched(
+        self,
+        file_id: str,
+        filename: str,
         documents: List[Document],
-        file_size: int
+        file_size: int,
+        content_hash: Optional[str] = None,
+        batch_size: int = 100,
+        concurrency: int = 8
     ) -> int:
-        """添加文档到向量存储（线程安全）"""
+        """批量添加文档到向量存储（分批流水线：嵌入完一批立即写入一批）
+
+        先切分为节点，再按 batch_size 分批调用嵌入 API，用 Semaphore 限制
+        并发批次数使网络延迟相互重叠；每个批次嵌入完成后立即 upsert 到
+        Qdrant，而不是攒齐所有嵌入再一次性写入——嵌入与写入两级流水线
+        重叠，且在途数据量被限制在 concurrency × batch_size 个节点，
+        大文件摄取的峰值内存不再随文件大小增长。
+
+        Args:
+            batch_size: 每批嵌入的节点数（OpenAI 嵌入 API 单次上限内）
+            concurrency: 同时在途的嵌入请求数
+
+        Returns:
+            插入的节点（分块）数量
+        """
         # 确保 index 已初始化
         if self.index is None:
             await self.initialize()
-        
-        # 为每个文档添加 file_id 元数据
+
+        # 为每个文档添加 file_id 元数据（共享一个 dict，每文档一次 update）
+        meta = {"file_id": file_id, "filename": filename}
         for doc in documents:
-            doc.metadata["file_id"] = file_id
-            doc.metadata["filename"] = filename
-        
-        # 使用锁保护文档插入操作
-        # 注意：虽然 Qdrant 本身是线程安全的，但 LlamaIndex 的 insert 操作可能涉及内部状态更新
-        async with self._index_lock:
-            for doc in documents:
-                self.index.insert(doc)
-        
-        # 保存文件元数据到 MongoDB（MongoDB 客户端是线程安全的）
+            doc.metadata.update(meta)
+
+        # 切分为节点
+        nodes = Settings.node_parser.get_nodes_from_documents(documents)
+
+        # 分批并发：嵌入 → 写入 两级流水线
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def embed_and_store(batch):
+            async with semaphore:
+                texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in batch]
+                embeddings = await Settings.embed_model.aget_text_embedding_batch(texts)
+                for node, embedding in zip(batch, embeddings):
+                    node.embedding = embedding
+            # 本批嵌入完成即写入，释放信号量让下一批嵌入与写入重叠。
+            # 写入不持有 _index_lock：Qdrant upsert 按点 ID 幂等且并发安全，
+            # 锁只用于 initialize 的双重检查构造，并发上传不再相互排队
+            await self.vector_store.async_add(batch)
+
+        batches = [nodes[i:i + batch_size] for i in range(0, len(nodes), batch_size)]
+        await asyncio.gather(*[embed_and_store(b) for b in batches])
+
+        await self._save_file_metadata(
+            file_id, filename, file_size, len(nodes), content_hash
+        )
+
+        self.files_version += 1
+        return len(nodes)
+
+    async def _save_file_metadata(
+        self,
+        file_id: str,
+        filename: str,
+        file_size: int,
+        chunks_count: int,
+        content_hash: Optional[str] = None
+    ):
+        """保存文件元数据到 MongoDB（MongoDB 客户端是线程安全的）"""
         metadata = {
             "file_id": file_id,
             "filename": filename,
             "size": file_size,
-            "uploaded_at": datetime.now().isoformat(),
-            "chunks_count": len(documents)
+            # 存原生 datetime（BSON date）：读取时无需解析，可排序可比较，
+            # orjson 在响应序列化时以 C 路径直接输出 ISO 8601
+            "uploaded_at": datetime.now(),
+            "chunks_count": chunks_count,
+            "content_hash": content_hash
         }
         await self.metadata_collection.insert_one(metadata)
-        
-        return len(documents)
     
     async def delete_file(self, file_id: str) -> int:
         """删除文件及其所有相关向量"""
-        # 检查文件是否存在
-        file_doc = await self.metadata_collection.find_one({"file_id": file_id})
-        if not file_doc:
-            return 0
-        
-        # 使用 Qdrant Filter 删除 (更高效)
-        try:
-            # 尝试删除 - LlamaIndex 默认将 metadata 扁平化存储在 payload 中
-            await self.qdrant_client.delete(
-                collection_name=app_settings.QDRANT_COLLECTION,
-                points_selector=qmodels.FilterSelector(
-                    filter=qmodels.Filter(
-                        must=[
-                            qmodels.FieldCondition(
-                                key="file_id",
-                                match=qmodels.MatchValue(value=file_id)
-                            )
-                        ]
-                    )
-                )
-            )
-        except Exception as e:
-            logger.error(f"Error deleting from Qdrant: {e}")
-            # 如果之前的代码认为 metadata 是嵌套的，尝试嵌套删除
-            try:
-                await self.qdrant_client.delete(
-                    collection_name=app_settings.QDRANT_COLLECTION,
-                    points_selector=qmodels.FilterSelector(
-                        filter=qmodels.Filter(
-                            must=[
-                                qmodels.FieldCondition(
-                                    key="metadata.file_id",
-                                    match=qmodels.MatchValue(value=file_id)
-                                )
-                            ]
-                        )
-                    )
-                )
-            except Exception:
-                pass
+        deleted = await self.adelete_files([file_id])
+        return 1 if deleted else 0  # 具体删除了多少个向量难以精确统计，但这不重要
 
-        # 删除文件元数据 from MongoDB
-        await self.metadata_collection.delete_one({"file_id": file_id})
-        
-        # 删除物理文件（使用保存时的扩展名）
-        file_ext = os.path.splitext(file_doc['filename'])[1].lower()
-        file_path = os.path.join(app_settings.UPLOAD_DIR, f"{file_id}{file_ext}")
-        if os.path.exists(file_path):
+    async def adelete_files(self, file_ids: List[str]) -> List[str]:
+        """批量删除文件及其向量（所有文件共享一次 Qdrant 往返）
+
+        跨文件的 should 过滤器让 N 个文件的向量删除合并为一次 delete 调用，
+        元数据删除合并为一次 delete_many。LlamaIndex 将 metadata 扁平化
+        存储在 payload 中，且 initialize 已为 file_id 声明 keyword 索引，
+        键名是确定的，不再需要 metadata.file_id 的兜底二次删除。
+
+        Returns:
+            实际删除的 file_id 列表（不存在的 id 被跳过）
+        """
+        if not file_ids:
+            return []
+
+        # 只处理元数据中确实存在的文件
+        docs = await self.metadata_collection.find(
+            {"file_id": {"$in": file_ids}}, {"_id": 0, "file_id": 1, "filename": 1}
+        ).to_list(length=None)
+        if not docs:
+            return []
+        existing = [doc["file_id"] for doc in docs]
+
+        # 向量删除、元数据删除、物理文件删除三者相互独立，
+        # 并发执行后总耗时是 max 而不是 sum；os.remove 放线程池避免阻塞事件循环
+        def _remove(path: str):
             try:
-                os.remove(file_path)
+                os.remove(path)
             except OSError:
                 pass
-        
-        return 1 # 返回 1 表示成功，具体删除了多少个向量难以精确统计，但这不重要
+
+        paths = [
+            os.path.join(
+                app_settings.UPLOAD_DIR,
+                f"{doc['file_id']}{os.path.splitext(doc['filename'])[1].lower()}"
+            )
+            for doc in docs
+        ]
+        await asyncio.gather(
+            self.qdrant_client.delete(
+                collection_name=app_settings.QDRANT_COLLECTION,
+                points_selector=qmodels.FilterSelector(
+                    filter=self._file_filter(existing)
+                )
+            ),
+            self.metadata_collection.delete_many({"file_id": {"$in": existing}}),
+            *[asyncio.to_thread(_remove, p) for p in paths],
+        )
+
+        self.files_version += 1
+        return existing
     
-    async def get_all_files(self) -> List[Dict]:
-        """获取所有文件信息"""
-        cursor = self.metadata_collection.find({}, {"_id": 0})
-        files = await cursor.to_list(length=None)
-        return files
+    async def get_all_files(self, limit: int = 500, skip: int = 0) -> List[Dict]:
+        """分页获取文件信息（按上传时间倒序）
+
+        length=None 的全量拉取会把整个集合反序列化进内存；
+        limit + skip 把单次响应的 BSON 解码量限制在一页之内。
+        """
+        cursor = (
+            self.metadata_collection.find({}, {"_id": 0})
+            .sort("uploaded_at", -1)
+            .skip(skip)
+            .limit(limit)
+        )
+        return await cursor.to_list(length=limit)
 
 
 # 单例实例（依赖注入模式）